@@ -0,0 +1,122 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This script measures the overhead of pset itself, without the experiment hardware:
+# perf, pqos, taskset, numactl and the rpd workload are replaced by the stand-ins in fakebin/,
+# which print the same output as the real tools instantly
+#
+# for runs of 1 to 1000 executions it measures
+#   runs/s  - ProgramSet.run end to end (script generation, shell and tool startup, parsing, archiving)
+#   parse/s - executions parsed per second by collectStats, on the outputs of a finished run
+# and prints where the time of the runs went (see ProgramSet.overheadReport)
+#
+# usage:
+#   python3 bench.py                               # 1, 10, 100 and 1000 executions
+#   python3 bench.py -n 1 10 --archive -o bench.json
+#   python3 bench.py --baseline bench.json         # exit 1 if runs/s or parse/s dropped by more than --tolerance
+#
+
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "../pset"))
+from pset import Program, ProgramSet, err
+from archive import Archive
+
+
+# a ProgramSet with the features of the regression scripts, one program of n threads
+def programSet(n: int, mba: bool) -> ProgramSet:
+    ps = ProgramSet([Program([f"workload 5000000 8 9999999 {i % 16}" for i in range(n)], "bench")],
+                    cpus = range(n), dir = "bench-data", timeout = "20s")
+    ps.addEvent("offcore_response.all_data_rd.llc_miss.local_dram", sum)
+    ps.addEvent("cycles", min)
+    ps.addEvent("task-clock", sum)
+    ps.extractFeature(r"(\d+) out of \d+ accesses completed", sum, progress=1)
+    ps.computeFeature("rate", lambda p, c: p / c, "progress", "cycles", combiner=max)
+    ps.recordBacking()
+    if mba: ps.setMBA(50)
+    ps.setTiming(True)
+    return ps
+
+# run the harness end to end, return runs per second
+def benchRuns(ps: ProgramSet, runs: int) -> float:
+    start = time.perf_counter()
+    for r in range(runs):
+        ps.run(f"run{r}")
+    return runs / (time.perf_counter() - start)
+
+# parse the outputs of the last run again and again for at least the given time, return executions per second
+def benchParse(ps: ProgramSet, seconds: float) -> float:
+    parsed = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        for group in ps.lastExecutions:
+            ps.collectStats(group)
+            parsed += len(group)
+    return parsed / elapsed
+
+def bench(n: int, args) -> dict:
+    ps = programSet(n, args.mba)
+    if args.archive: ps.setArchive(Archive(f"bench-{n}.db"), keepFiles = True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        runsPerSecond = benchRuns(ps, args.runs)
+        parsePerSecond = benchParse(ps, args.parse_seconds)
+    print(f"\n{n} executions: {runsPerSecond:.2f} runs/s, {parsePerSecond:.0f} executions parsed/s")
+    print(ps.overheadReport())
+    return {'runs/s': runsPerSecond, 'parse/s': parsePerSecond,
+            'ms/run': {name: 1000 * seconds / ps.timedRuns for name, seconds in ps.spanTotals.items()}}
+
+# compare with the results of an earlier benchmark, return the regressions found
+def regressions(results: dict, baseline: dict, tolerance: float):
+    found = []
+    for n, result in results.items():
+        if n not in baseline: continue
+        for metric in ['runs/s', 'parse/s']:
+            before, now = baseline[n][metric], result[metric]
+            if now < before * (1 - tolerance):
+                found.append(f"{n} executions: {metric} dropped from {before:.2f} to {now:.2f} ({now/before - 1:.1%})")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="measure the overhead of pset with fake perf/pqos/workload binaries")
+    parser.add_argument("-n", "--executions", type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help="numbers of executions per run to benchmark")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="runs per number of executions")
+    parser.add_argument("--parse-seconds", type=float, default=1.0, help="time spent measuring parse throughput")
+    parser.add_argument("--archive", action="store_true", help="archive every run (in a temporary database)")
+    parser.add_argument("--mba", action="store_true", help="throttle every core with MBA to include the pqos calls")
+    parser.add_argument("-o", "--out", help="json file to save the results to")
+    parser.add_argument("--baseline", help="json file of earlier results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative drop from the baseline")
+    args = parser.parse_args()
+
+    os.environ["PATH"] = os.path.join(HERE, "fakebin") + os.pathsep + os.environ["PATH"]
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix="pset-bench-")
+    os.chdir(workdir)
+
+    results = dict()
+    for n in args.executions:
+        results[str(n)] = bench(n, args)
+    shutil.rmtree(workdir)
+
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved results to {out}")
+    if baseline:
+        with open(baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for r in found: err("(regression)", r)
+        if found: exit(1)
+        print(f"\nno regression beyond {args.tolerance:.0%} of {baseline}")
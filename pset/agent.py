@@ -0,0 +1,314 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module spreads ProgramSet runs over several machines
+#
+# An agent runs on each machine, accepts run requests over a socket, runs them locally with pset
+# and sends back the features and outputs of the run along with the machine's hardware fingerprint.
+# A Dispatcher on the client hands the points of a sweep to a pool of agents, one run per agent at a time,
+# and only uses agents whose fingerprint matches, so that results from different hardware are never mixed.
+#
+# Requests and replies are single lines of json. Functions cannot be sent, so the agent only
+# extracts the raw features of each execution; computed features and combiners are applied on the client
+# with its own ProgramSet (combiners are matched by name on the agent, for the metrics it records itself).
+#
+# An agent runs the commands it is sent as shell commands, usually as root (pqos, resctrl and hugepages need it),
+# so it only listens on localhost by default. To accept other machines it must be given a shared secret
+# that every request has to carry, and it should only be reachable from the experiment network.
+#
+# start an agent (in the directory the commands expect, e.g. with the ./rpd binary):
+#   python3 agent.py --port 7000                                    # localhost only
+#   PSET_AGENT_TOKEN=<secret> python3 agent.py --host 0.0.0.0 --port 7000
+# several agents on one machine (e.g. to test) just need different ports and directories
+#
+# example:
+#   dispatcher = Dispatcher([("node1", 7000), ("node2", 7000)], token=os.environ["PSET_AGENT_TOKEN"])
+#   for result in dispatcher.map(ps, [([progX, progY], "XY", {'delayX': 3, 'delayY': 12}), ...]):
+#       print(result.host, result.stats)
+#
+
+import os
+import copy
+import hmac
+import json
+import zlib
+import base64
+import socket
+import argparse
+import threading
+import statistics
+import socketserver
+from queue import Queue, Empty
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Iterable
+from dataclasses import dataclass, field
+
+from pset import err, Program, ProgramSet, Execution, PerfCounter, Extracted, Backing, Monitored
+from archive import readOutputs
+import topology
+
+# combiners the agent can apply by name
+COMBINERS = {'sum': sum, 'min': min, 'max': max, 'len': len, 'mean': statistics.mean}
+
+# a point of a sweep: the programs to run together, the stamp of the run and its params
+Point = Tuple[List[Program], str, Dict[str, Any]]
+
+
+def _pack(data: bytes) -> str:
+    return base64.b64encode(zlib.compress(data)).decode()
+
+def _unpack(data: str) -> bytes:
+    return zlib.decompress(base64.b64decode(data))
+
+def send(stream, message: Dict[str, Any]):
+    stream.write(json.dumps(message).encode() + b'\n')
+    stream.flush()
+
+def receive(stream) -> Dict[str, Any]:
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+
+# rebuild (on the agent) a ProgramSet from a config made by ProgramSet.config(), without its computed features
+def buildProgramSet(config: Dict[str, Any]) -> ProgramSet:
+    ps = ProgramSet([Program(p['commands'], p['label'], p['memory']) for p in config['programs']],
+                    config['cpus'], timeout = config['timeout'])
+    for f in config['features']:
+        combiner = COMBINERS.get(f['combiner'], sum)
+        match f['kind']:
+            case 'PerfCounter': ps.features.append(PerfCounter(f['name'], combiner))
+            case 'Extracted': ps.features.append(Extracted(f['name'], combiner, f['regex'], f['group']))
+            case 'Backing': ps.features.append(Backing(f['name'], combiner))
+            case 'Monitored': ps.features.append(Monitored(f['name'], combiner, f['event']))
+    ps.setAutoCAT(config['autoCAT'])
+    mba = config['mba']
+    ps.mba = {int(k) if k.isdigit() else k: v for k, v in mba.items()} if type(mba) == dict else mba
+    if config['placement']: ps.setPlacement(config['placement'], config['bindMemory'])
+    if config['hugepages']: ps.setHugepages(True, config['reserveHugepages'])
+    ps.resctrlRoot = config['resctrlRoot']
+    ps.monitorInterval = config['monitorInterval']
+    ps.setTiming(config['timing'])
+    return ps
+
+# run a request on this machine and build the reply
+def runRequest(request: Dict[str, Any]) -> Dict[str, Any]:
+    ps = buildProgramSet(request['config'])
+    ps.dir = request.get('dir', ps.dir)
+    stats = ps.run(request['stamp'], request.get('params'))
+    exitStatus = ps.lastExitStatus
+    execs = ps.lastExecutions
+    programs = []
+    for group, stat in zip(execs, stats):
+        programs.append({
+            'stats': {k: v for k, v in stat.items()},
+            'executions': [{'cpu': exe.cpu, 'features': ps.getFeatures(exe),
+                            'outputs': {kind: _pack(data) for kind, data in readOutputs(exe).items()}}
+                           for exe in group],
+        })
+    cos = [{'class': c, 'cpu': cpu, 'cat': mask, 'mba': level} for c, cpu, mask, level in ps.allocateCOS(execs)]
+    ps.removeFiles(request['stamp'], execs)
+    return {'programs': programs, 'cos': cos, 'exitStatus': exitStatus}
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    def authorized(self, request) -> bool:
+        token = self.server.token
+        return token is None or hmac.compare_digest(str(request.get('token', '')).encode(), token.encode())
+
+    def handle(self):
+        while (request := receive(self.rfile)) is not None:
+            if not self.authorized(request):
+                err(f"(agent error) refused a request without a valid token from {self.client_address[0]}")
+                send(self.wfile, {'error': "refused: invalid token"})
+                return
+            reply = {'host': socket.gethostname(), 'fingerprint': topology.fingerprint()}
+            try:
+                match request['op']:
+                    case 'fingerprint': pass
+                    case 'run': reply |= runRequest(request)
+                    case op: reply['error'] = f"unknown op {op}"
+            except (Exception, SystemExit) as e:
+                # pset reports errors with exit(1), which must not stop the agent
+                reply['error'] = f"{type(e).__name__}: {e}"
+            send(self.wfile, reply)
+
+class AgentServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, token: str = None):
+        self.token = token
+        super().__init__(address, handler)
+
+LOCALHOST = ['127.0.0.1', 'localhost', '::1']
+
+# serve run requests, one at a time since runs need the machine to themselves
+# params:
+#   host - address to listen on, listening beyond localhost requires a token
+#   token - shared secret every request must carry, None to accept any request (localhost only)
+def serve(port: int, host: str = "127.0.0.1", token: str = None):
+    if host not in LOCALHOST and not token:
+        err(f"(agent error) listening on {host or 'every interface'} requires a token (--token or PSET_AGENT_TOKEN)")
+        exit(1)
+    with AgentServer((host, port), AgentHandler, token) as server:
+        print(f"agent {socket.gethostname()} ({topology.fingerprint()}) listening on port {port}")
+        server.serve_forever()
+
+
+# the result of a point run by an agent
+@dataclass
+class RemoteRun:
+    point: int              # index of the point in the sweep
+    host: str
+    fingerprint: str
+    stats: List[Dict[str, Any]] = field(default_factory=list)   # collected metrics of each program
+    runId: str = None       # id in the client's archive, if it has one
+    error: str = None
+    exitStatus: int = None  # exit status of the run's script on the agent (as returned by os.system)
+
+
+class Agent:
+    def __init__(self, address: Tuple[str, int], token: str = None):
+        self.address = address
+        self.token = token
+        self.socket = socket.create_connection(address)
+        self.stream = self.socket.makefile('rwb')
+        reply = self.request({'op': 'fingerprint'})
+        self.host, self.fingerprint = reply['host'], reply['fingerprint']
+
+    def __repr__(self):
+        return f"Agent({self.address[0]}:{self.address[1]}, {self.host}, {self.fingerprint})"
+
+    def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        send(self.stream, {**message, 'token': self.token} if self.token else message)
+        reply = receive(self.stream)
+        if reply is None: raise ConnectionError(f"agent at {self.address} closed the connection")
+        if 'host' not in reply: raise ConnectionError(f"agent at {self.address} {reply['error']}")
+        return reply
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+
+class Dispatcher:
+    # params:
+    #   addresses - (host, port) of each agent
+    #   fingerprint - hardware fingerprint to accept, by default the one most agents share
+    #   token - shared secret the agents were started with
+    def __init__(self, addresses: Iterable[Tuple[str, int]], fingerprint: str = None, token: str = None):
+        agents = []
+        for address in addresses:
+            try:
+                agents.append(Agent(address, token))
+            except OSError as e:
+                err(f"(agent error) could not reach agent at {address}: {e}")
+        if not agents:
+            err("(agent error) no agents available")
+            exit(1)
+
+        self.fingerprint = fingerprint if fingerprint else Counter(a.fingerprint for a in agents).most_common(1)[0][0]
+        self.agents = [a for a in agents if a.fingerprint == self.fingerprint]
+        for a in agents:
+            if a.fingerprint != self.fingerprint:
+                err(f"(agent warning) not using {a}: its hardware differs from {self.fingerprint}")
+                a.close()
+        if not self.agents:
+            err(f"(agent error) no agents with fingerprint {self.fingerprint}")
+            exit(1)
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__, self.__dict__)
+
+    def close(self):
+        for a in self.agents: a.close()
+
+    # rebuild the metrics of each program from the agent's reply, computing the client's computed features
+    def collect(self, ps: ProgramSet, reply: Dict[str, Any]) -> List[Dict[str, Any]]:
+        stats = []
+        for program in reply['programs']:
+            combined = ps.combineStats([ps.computeFeatures(exe['features']) for exe in program['executions']])
+            # keep what the agent recorded beyond the features (placement, mba, time series...)
+            stats.append({**program['stats'], **combined})
+        return stats
+
+    # archive a run made by an agent in the client's archive
+    def archive(self, ps: ProgramSet, stamp: str, params, reply, stats) -> str:
+        execs = [[Execution("", exe['cpu'], "", "", "") for exe in program['executions']] for program in reply['programs']]
+        outputs = [[{kind: _unpack(data) for kind, data in exe['outputs'].items()} for exe in program['executions']]
+                   for program in reply['programs']]
+        with self.lock:
+            return ps.archive.record(ps, stamp, execs, stats, reply['exitStatus'], params,
+                                     outputs = outputs, cos = reply['cos'],
+                                     host = reply['host'], fingerprint = reply['fingerprint'])
+
+    # take points off the queue and run them on an agent until every point has a result
+    # (a point given back by a lost agent is picked up by the agents still working)
+    # or until the agent is lost
+    def _work(self, agent: Agent, ps: ProgramSet, points: Queue, results: Dict[int, RemoteRun], total: int):
+        while True:
+            try:
+                i, (programs, stamp, params) = points.get(timeout=0.1)
+            except Empty:
+                with self.lock:
+                    if len(results) == total: return
+                continue
+            job = copy.copy(ps)
+            job.setPrograms(programs)
+            try:
+                reply = agent.request({'op': 'run', 'config': job.config(), 'stamp': stamp,
+                                       'params': params, 'dir': ps.dir})
+            except (OSError, ConnectionError) as e:
+                # give the point back to the other agents and stop using this one
+                err(f"(agent error) lost {agent}: {e}")
+                points.put((i, (programs, stamp, params)))
+                with self.lock:
+                    self.agents.remove(agent)
+                agent.close()
+                return
+            if reply.get('error'):
+                err(f"(agent error) point {i} failed on {agent.host}: {reply['error']}")
+                run = RemoteRun(i, reply['host'], reply['fingerprint'], error = reply['error'])
+            else:
+                try:
+                    stats = self.collect(job, reply)
+                    runId = self.archive(job, stamp, params, reply, stats) if ps.archive else None
+                    print(f"point {i} done on {agent.host}")
+                    run = RemoteRun(i, reply['host'], reply['fingerprint'], stats, runId, exitStatus = reply['exitStatus'])
+                except Exception as e:
+                    # e.g. a KeyError when the client's features do not match what the agent extracted
+                    error = f"{type(e).__name__}: {e}"
+                    err(f"(agent error) could not collect point {i} from {agent.host}: {error}")
+                    run = RemoteRun(i, reply['host'], reply['fingerprint'], error = error,
+                                    exitStatus = reply['exitStatus'])
+            with self.lock:
+                results[i] = run
+
+    # run the points of a sweep on the agents, with the features (and archive) of the given ProgramSet
+    # each point is (programs, stamp, params)
+    # returns a RemoteRun per point, in the order of the points
+    # (points left over because every agent was lost are missing from the result, with an error)
+    def map(self, ps: ProgramSet, points: Iterable[Point]) -> List[RemoteRun]:
+        queue = Queue()
+        for i, point in enumerate(points): queue.put((i, point))
+        total = queue.qsize()
+        results = dict()
+        workers = [threading.Thread(target=self._work, args=(a, ps, queue, results, total)) for a in list(self.agents)]
+        for w in workers: w.start()
+        for w in workers: w.join()
+        if len(results) < total:
+            err(f"(agent error) every agent was lost, {total - len(results)} points were not run")
+        return [results[i] for i in sorted(results)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run ProgramSet requests sent by a Dispatcher")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (localhost by default, other addresses require a token)")
+    parser.add_argument("--token", default=os.environ.get("PSET_AGENT_TOKEN"),
+                        help="shared secret requests must carry (default: $PSET_AGENT_TOKEN)")
+    parser.add_argument("--workdir", default=".", help="directory to run the commands in")
+    args = parser.parse_args()
+    os.chdir(args.workdir)
+    serve(args.port, args.host, args.token)
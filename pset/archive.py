@@ -0,0 +1,212 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module stores the runs of a ProgramSet in an indexed SQLite database
+# instead of leaving .out/.err/.perf/.info files behind for every run
+#
+# Each run is one record with a unique id holding
+#   the ProgramSet config (and its hash), the extra params given to run(),
+#   the placement and CAT/MBA state, the compressed stdout/stderr/perf of every execution
+#   and the collected features of every program
+#
+# Outputs are stored once per distinct content (many runs print the same stderr, for example)
+#
+# example:
+#   ps.setArchive(Archive("l3contention.db"))
+#   ...
+#   for runId in Archive("l3contention.db").find(delayX=3):
+#       print(archive.features(runId))
+#
+
+import os
+import json
+import zlib
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import itertools as it
+from typing import List, Dict, Any
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created INTEGER,
+    host TEXT,
+    stamp TEXT,
+    config_hash TEXT,
+    config TEXT,
+    placement TEXT,
+    cos TEXT,
+    exit_status INTEGER,
+    fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS params (
+    run_id TEXT,
+    key TEXT,
+    value
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id TEXT,
+    program INTEGER,
+    execution INTEGER,
+    cpu INTEGER,
+    kind TEXT,
+    digest TEXT
+);
+CREATE TABLE IF NOT EXISTS features (
+    run_id TEXT,
+    program INTEGER,
+    label TEXT,
+    name TEXT,
+    value,
+    json INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_config ON runs(config_hash);
+CREATE INDEX IF NOT EXISTS runs_fingerprint ON runs(fingerprint);
+CREATE INDEX IF NOT EXISTS runs_created ON runs(created);
+CREATE INDEX IF NOT EXISTS params_key_value ON params(key, value);
+CREATE INDEX IF NOT EXISTS params_run ON params(run_id);
+CREATE INDEX IF NOT EXISTS artifacts_run ON artifacts(run_id);
+CREATE INDEX IF NOT EXISTS features_run ON features(run_id);
+CREATE INDEX IF NOT EXISTS features_name ON features(name);
+"""
+
+# the kinds of output an execution leaves, and the Execution attribute with its path
+ARTIFACTS = {'out': 'stdout', 'err': 'stderr', 'perf': 'perfout'}
+
+# the output files an execution left, as {kind: bytes}
+def readOutputs(exe) -> Dict[str, bytes]:
+    outputs = dict()
+    for kind, attr in ARTIFACTS.items():
+        path = getattr(exe, attr)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                outputs[kind] = f.read()
+    return outputs
+
+# hash identifying a config, independent of key order
+def configHash(config: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+# whether _encode stores a value as json
+def _isJson(value) -> bool:
+    return not (isinstance(value, (int, float, str)) or value is None)
+
+# values that are not numbers or strings (e.g. time series) are stored as json,
+# dicts with their keys as sorted strings (as in ProgramSet.config) so that equal dicts match in find()
+def _encode(value):
+    if not _isJson(value): return value
+    if isinstance(value, dict): return json.dumps({str(k): v for k, v in value.items()}, sort_keys=True)
+    return json.dumps(value)
+
+
+class Archive:
+    def __init__(self, path: str = "pset-archive.db"):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__, {'path': self.path})
+
+    def close(self):
+        self.db.close()
+
+    # store a blob (compressed) under the hash of its content, return the hash
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        self.db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (digest, zlib.compress(data)))
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        row = self.db.execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    # store a finished run of a ProgramSet
+    # execs are its execution groups and stats the metrics collected from them
+    # runs made on another machine (see agent.py) pass their outputs as {kind: bytes} for each execution,
+    # their classes of service, host and hardware fingerprint instead of them being read locally
+    # return the id of the new run
+    def record(self, ps, stamp: str, execs, stats: List[Dict[str, Any]],
+               exitStatus: int = 0, params: Dict[str, Any] = None,
+               outputs: List[List[Dict[str, bytes]]] = None, cos: List[Dict[str, Any]] = None,
+               host: str = None, fingerprint: str = None) -> str:
+        runId = uuid.uuid4().hex
+        config = ps.config()
+        if cos is None:
+            cos = [{'class': c, 'cpu': cpu, 'cat': mask, 'mba': level} for c, cpu, mask, level in ps.allocateCOS(execs)]
+        placement = [[exe.cpu for exe in group] for group in execs]
+
+        with self.db:
+            self.db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (runId, time.time_ns(), host or socket.gethostname(), stamp, configHash(config),
+                 json.dumps(config), json.dumps(placement), json.dumps(cos), exitStatus, fingerprint))
+
+            # index the config parameters along with the extra params of the run
+            flat = {'timeout': config['timeout'], 'autoCAT': config['autoCAT'],
+                    'placement': config['placement'], 'mba': config['mba'],
+                    **{f"label{i}": p['label'] for i, p in enumerate(config['programs'])},
+                    **(params or {})}
+            self.db.executemany("INSERT INTO params VALUES (?, ?, ?)",
+                [(runId, k, _encode(v)) for k, v in flat.items()])
+
+            for i, group in enumerate(execs):
+                for j, exe in enumerate(group):
+                    data = outputs[i][j] if outputs else readOutputs(exe)
+                    for kind, content in data.items():
+                        self.db.execute("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                            (runId, i, j, exe.cpu, kind, self.put(content)))
+
+            self.db.executemany("INSERT INTO features VALUES (?, ?, ?, ?, ?, ?)",
+                [(runId, i, p.label, name, _encode(value), _isJson(value))
+                 for i, (p, stat) in enumerate(zip(ps.programs, stats)) for name, value in stat.items()])
+        return runId
+
+    # ids of the runs whose params (config parameters or params given to run()) match all the given values
+    # (None matches params that were None, e.g. placement=None for runs without a placement policy)
+    # also accepts config_hash to select runs of one config and fingerprint to select runs of one kind of machine
+    def find(self, config_hash: str = None, fingerprint: str = None, **params) -> List[str]:
+        columns = {'config_hash': config_hash, 'fingerprint': fingerprint}
+        conditions = [f"{c} = ?" for c, v in columns.items() if v]
+        query = "SELECT run_id FROM runs" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        args = [v for v in columns.values() if v]
+        for key, value in params.items():
+            if value is None:
+                query += " INTERSECT SELECT run_id FROM params WHERE key = ? AND value IS NULL"
+                args += [key]
+            else:
+                query += " INTERSECT SELECT run_id FROM params WHERE key = ? AND value = ?"
+                args += [key, _encode(value)]
+        return [row[0] for row in self.db.execute(query, args)]
+
+    # the run record (without outputs) as a dict
+    def run(self, runId: str) -> Dict[str, Any]:
+        cursor = self.db.execute("SELECT * FROM runs WHERE run_id = ?", (runId,))
+        row = cursor.fetchone()
+        if not row: return None
+        run = dict(zip([d[0] for d in cursor.description], row))
+        for key in ['config', 'placement', 'cos']:
+            run[key] = json.loads(run[key])
+        run['params'] = dict(self.db.execute("SELECT key, value FROM params WHERE run_id = ?", (runId,)).fetchall())
+        return run
+
+    # the collected metrics of a run, as returned by ProgramSet.run (a dict per program)
+    # values stored as json are decoded, with tuples (e.g. the points of a time series) coming back as lists
+    def features(self, runId: str) -> List[Dict[str, Any]]:
+        rows = self.db.execute("SELECT program, name, value, json FROM features WHERE run_id = ? ORDER BY program, rowid",
+                               (runId,))
+        return [{name: json.loads(value) if encoded else value for _, name, value, encoded in group}
+                for _, group in it.groupby(rows, key=lambda r: r[0])]
+
+    # the outputs of a run as a list of (program, execution, cpu, {kind: text}) in execution order
+    def artifacts(self, runId: str):
+        rows = self.db.execute("SELECT program, execution, cpu, kind, digest FROM artifacts "
+                               "WHERE run_id = ? ORDER BY program, execution", (runId,))
+        return [(program, execution, cpu, {kind: self.get(digest).decode(errors='replace') for *_, kind, digest in group})
+                for (program, execution, cpu), group in it.groupby(rows, key=lambda r: r[:3])]
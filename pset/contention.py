@@ -0,0 +1,147 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module runs contention experiments on top of a ProgramSet:
+# each program of a mix is run alone to get its baseline, then all of them are run together,
+# and the slowdown of each program is computed from a progress metric
+#
+# Mixes are not limited to pairs. The programs of a mix are named X, Y, Z, W, P4, P5, ...
+# and a sample becomes one wide row with the columns the regression scripts use:
+#   <param><name>     parameters of the program, e.g. delayX
+#   <feature><name>   features of the solo run, e.g. progressX
+#   <feature><name>'  features of the co-run, e.g. progressX'
+#   slowdown<name>
+#
+# example:
+#   exp = ContentionExperiment(ps, progress="progress")
+#   record = exp.run([progX, progY], params=[{'delay': 3}, {'delay': 12}])
+#   data = pd.concat([data, pd.DataFrame([record.row()])])
+#
+
+from typing import List, Dict, Any, Callable
+from dataclasses import dataclass, field
+
+from pset import Program, ProgramSet, err
+import topology
+
+NAMES = ['X', 'Y', 'Z', 'W']
+
+# name of the i-th program of a mix
+def programName(i: int) -> str:
+    return NAMES[i] if i < len(NAMES) else f"P{i}"
+
+
+# the outcome of one mix
+@dataclass
+class ContentionRecord:
+    labels: List[str]
+    solo: List[Dict[str, Any]]      # collected metrics of each program run alone
+    corun: List[Dict[str, Any]]     # collected metrics of each program in the co-run
+    slowdown: List[float]
+    params: List[Dict[str, Any]] = field(default_factory=list)    # parameters of each program
+
+    def names(self) -> List[str]:
+        return [programName(i) for i in range(len(self.labels))]
+
+    # the record as one wide row (see the top of this file for the columns)
+    def row(self) -> Dict[str, Any]:
+        row = dict()
+        for name, params, solo in zip(self.names(), self.params or [{}]*len(self.labels), self.solo):
+            for k, v in params.items(): row[k+name] = v
+            for k, v in solo.items(): row[k+name] = v
+        for name, corun in zip(self.names(), self.corun):
+            for k, v in corun.items(): row[k+name+"'"] = v
+        for name, slowdown in zip(self.names(), self.slowdown):
+            row['slowdown'+name] = slowdown
+        return row
+
+
+class ContentionExperiment:
+    # params:
+    #   ps - the ProgramSet (features, cpus, placement, CAT/MBA...) to run the mixes with
+    #   progress - name of the feature measuring a program's progress, or a function of a program's metrics
+    #   higherIsBetter - true if more progress means faster (e.g. accesses completed),
+    #                    false for metrics like runtime where the slowdown is co-run / solo
+    #   parallelSolos - run the solo runs of a mix together, each program on its own NUMA node
+    #                   (as many at a time as there are nodes), instead of one after the other;
+    #                   only done when they share nothing (see isolatedSolos), otherwise solos run one at a time
+    def __init__(self, ps: ProgramSet, progress: str | Callable[[Dict[str, Any]], float] = "progress",
+                 higherIsBetter = True, parallelSolos = False):
+        self.ps = ps
+        self.progress = progress
+        self.higherIsBetter = higherIsBetter
+        self.parallelSolos = parallelSolos
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__, self.__dict__)
+
+    def measure(self, stat: Dict[str, Any]) -> float:
+        return self.progress(stat) if callable(self.progress) else stat[self.progress]
+
+    def slowdown(self, solo: Dict[str, Any], corun: Dict[str, Any]) -> float:
+        s, c = self.measure(solo), self.measure(corun)
+        return s / c if self.higherIsBetter else c / s
+
+    # whether the solo runs can share the machine without sharing anything:
+    # every program on its own NUMA node (own LLC and memory controller) with its memory bound there,
+    # and no automatic CAT split, which would divide the cache among the cores of all the solo runs
+    def isolatedSolos(self, nodes: int) -> bool:
+        reasons = []
+        if nodes < 2: reasons.append("the cpus span a single NUMA node")
+        if not self.ps.bindMemory: reasons.append("memory is not bound to the nodes (setPlacement(..., bindMemory=True))")
+        if self.ps.autoAssignCAT: reasons.append("automatic CAT would split the cache among all solo runs")
+        for r in reasons:
+            err(f"(contention warning) running solos one after the other: {r}")
+        return not reasons
+
+    # run each program alone, return their collected metrics in mix order
+    def runSolos(self, mix: List[Program], params: List[Dict[str, Any]], stamp: str):
+        names = [programName(i) for i in range(len(mix))]
+        nodes = 0
+        if self.parallelSolos:
+            if self.ps.cpuTopology is None: self.ps.cpuTopology = topology.readTopology()
+            allowed = [c for c in self.ps.cpuTopology if not self.ps.cpus or c.id in self.ps.cpus]
+            nodes = len({c.node for c in allowed})
+
+        if not self.parallelSolos or not self.isolatedSolos(nodes):
+            solos = []
+            for name, prog, p in zip(names, mix, params):
+                print("running", prog)
+                self.ps.setPrograms([prog])
+                solos += self.ps.run(stamp + "solo-" + name, {k+name: v for k, v in p.items()})
+            return solos
+
+        # programs on different NUMA nodes share neither an LLC nor a memory controller,
+        # so the solo runs can share the machine one node each
+        placement = self.ps.placement
+        self.ps.placement = 'different-node'
+        solos = []
+        try:
+            for i in range(0, len(mix), nodes):
+                batch = slice(i, i + nodes)
+                print("running", *mix[batch])
+                self.ps.setPrograms(mix[batch])
+                solos += self.ps.run(stamp + "solo-" + ''.join(names[batch]),
+                                     {k+n: v for n, p in zip(names[batch], params[batch]) for k, v in p.items()})
+        finally:
+            self.ps.placement = placement
+        return solos
+
+    # run the solo runs and the co-run of a mix of programs
+    # params are parameters describing each program (e.g. {'delay': 3}), kept in the record
+    # and passed on to the archive with each run
+    def run(self, mix: List[Program], params: List[Dict[str, Any]] = None, stamp: str = "") -> ContentionRecord:
+        params = params if params else [{} for _ in mix]
+        if len(params) != len(mix):
+            err("(contention error) expected one dict of params per program in the mix")
+            exit(1)
+        names = [programName(i) for i in range(len(mix))]
+
+        solos = self.runSolos(mix, params, stamp)
+
+        print("running contended")
+        self.ps.setPrograms(mix)
+        coruns = self.ps.run(stamp + ''.join(names), {k+n: v for n, p in zip(names, params) for k, v in p.items()})
+
+        slowdowns = [self.slowdown(s, c) for s, c in zip(solos, coruns)]
+        return ContentionRecord([p.label for p in mix], solos, coruns, slowdowns, params)
@@ -0,0 +1,81 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module inspects the hugetlb page pools set up by set_hugepage_bootparams.sh
+# so that a ProgramSet can be checked against them before it is launched
+#
+# The pools are per NUMA node: a program pinned to a cpu takes its hugepages
+# from that cpu's node, so a plan has to fit node by node, not just in total
+#
+
+import os
+import re
+import glob
+from typing import Dict
+from dataclasses import dataclass
+
+
+# the free/total pages of one node's pool
+@dataclass
+class Pool:
+    node: int
+    total: int
+    free: int
+
+# parse /proc/meminfo into a dict of name -> value (in kB, or a count of pages)
+def meminfo(proc: str = "/proc") -> Dict[str, int]:
+    info = dict()
+    with open(f"{proc}/meminfo") as f:
+        for line in f:
+            m = re.match(r"(\S+):\s+(\d+)", line)
+            if m:
+                info[m.group(1)] = int(m.group(2))
+    return info
+
+# size in bytes of the default hugepage
+def pageSize(proc: str = "/proc") -> int:
+    return meminfo(proc)["Hugepagesize"] * 1024
+
+# number of hugepages of the given size needed to map a region of nbytes
+def pagesFor(nbytes: int, size: int) -> int:
+    return -(-nbytes // size)
+
+def _poolDir(node: int, size: int, sys: str) -> str:
+    return f"{sys}/devices/system/node/node{node}/hugepages/hugepages-{size // 1024}kB"
+
+def _readInt(path: str) -> int:
+    with open(path) as f:
+        return int(f.read().strip())
+
+# read the per-node pools of hugepages of the given size
+def nodePools(size: int, sys: str = "/sys") -> Dict[int, Pool]:
+    pools = dict()
+    for path in glob.glob(f"{sys}/devices/system/node/node[0-9]*"):
+        node = int(re.search(r"node(\d+)$", path).group(1))
+        d = _poolDir(node, size, sys)
+        if os.path.isdir(d):
+            pools[node] = Pool(node, _readInt(f"{d}/nr_hugepages"), _readInt(f"{d}/free_hugepages"))
+    return pools
+
+# the NUMA node a cpu belongs to (0 on machines without NUMA information)
+def cpuNode(cpu: int, sys: str = "/sys") -> int:
+    nodes = glob.glob(f"{sys}/devices/system/cpu/cpu{cpu}/node[0-9]*")
+    return int(re.search(r"node(\d+)$", nodes[0]).group(1)) if nodes else 0
+
+# try to grow a node's pool by `count` pages (requires root)
+# returns the pool as it stands afterwards, the kernel may grant fewer pages than asked for
+def reserve(node: int, count: int, size: int, sys: str = "/sys") -> Pool:
+    d = _poolDir(node, size, sys)
+    total = _readInt(f"{d}/nr_hugepages")
+    with open(f"{d}/nr_hugepages", 'w') as f:
+        f.write(str(total + count))
+    return Pool(node, _readInt(f"{d}/nr_hugepages"), _readInt(f"{d}/free_hugepages"))
+
+# pages still missing on each node for the given demand (node -> pages)
+def shortfall(demand: Dict[int, int], pools: Dict[int, Pool]) -> Dict[int, int]:
+    missing = dict()
+    for node, pages in demand.items():
+        free = pools[node].free if node in pools else 0
+        if pages > free:
+            missing[node] = pages - free
+    return missing
@@ -0,0 +1,91 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module provides the statistics used by ProgramSet.runUntilPrecise
+# to repeat a measurement until it is precise enough
+#
+
+import statistics
+from typing import List, Tuple
+from dataclasses import dataclass, field
+
+
+# result of a repeated measurement
+@dataclass
+class Estimate:
+    mean: float
+    ci: float           # half width of the confidence interval around the mean
+    relci: float        # ci relative to the mean
+    reps: int           # number of samples the estimate is made of
+    rejected: int       # runs thrown away as outliers or because their frequency drifted
+    samples: List[float] = field(default_factory=list)
+    runs: List[list] = field(default_factory=list)     # collected metrics of the kept runs
+
+
+# two-sided critical values of Student's t distribution for 1 to 30 degrees of freedom
+T_CONFIDENCES = [0.80, 0.90, 0.95, 0.98, 0.99]
+T_TABLE = [
+    [3.078, 6.314, 12.706, 31.821, 63.657],
+    [1.886, 2.920, 4.303, 6.965, 9.925],
+    [1.638, 2.353, 3.182, 4.541, 5.841],
+    [1.533, 2.132, 2.776, 3.747, 4.604],
+    [1.476, 2.015, 2.571, 3.365, 4.032],
+    [1.440, 1.943, 2.447, 3.143, 3.707],
+    [1.415, 1.895, 2.365, 2.998, 3.499],
+    [1.397, 1.860, 2.306, 2.896, 3.355],
+    [1.383, 1.833, 2.262, 2.821, 3.250],
+    [1.372, 1.812, 2.228, 2.764, 3.169],
+    [1.363, 1.796, 2.201, 2.718, 3.106],
+    [1.356, 1.782, 2.179, 2.681, 3.055],
+    [1.350, 1.771, 2.160, 2.650, 3.012],
+    [1.345, 1.761, 2.145, 2.624, 2.977],
+    [1.341, 1.753, 2.131, 2.602, 2.947],
+    [1.337, 1.746, 2.120, 2.583, 2.921],
+    [1.333, 1.740, 2.110, 2.567, 2.898],
+    [1.330, 1.734, 2.101, 2.552, 2.878],
+    [1.328, 1.729, 2.093, 2.539, 2.861],
+    [1.325, 1.725, 2.086, 2.528, 2.845],
+    [1.323, 1.721, 2.080, 2.518, 2.831],
+    [1.321, 1.717, 2.074, 2.508, 2.819],
+    [1.319, 1.714, 2.069, 2.500, 2.807],
+    [1.318, 1.711, 2.064, 2.492, 2.797],
+    [1.316, 1.708, 2.060, 2.485, 2.787],
+    [1.315, 1.706, 2.056, 2.479, 2.779],
+    [1.314, 1.703, 2.052, 2.473, 2.771],
+    [1.313, 1.701, 2.048, 2.467, 2.763],
+    [1.311, 1.699, 2.045, 2.462, 2.756],
+    [1.310, 1.697, 2.042, 2.457, 2.750],
+]
+
+# two-sided critical value of Student's t distribution
+# from the table up to 30 degrees of freedom (for the confidences in T_CONFIDENCES),
+# the normal quantile above that
+def tCritical(confidence: float, df: int) -> float:
+    if df > len(T_TABLE):
+        return statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    for column, c in enumerate(T_CONFIDENCES):
+        if abs(confidence - c) < 1e-9:
+            return T_TABLE[df - 1][column]
+    raise ValueError(f"no t critical values for confidence {confidence}, use one of {T_CONFIDENCES}")
+
+# mean of the samples and half width of its confidence interval
+def confidenceInterval(samples: List[float], confidence: float = 0.95) -> Tuple[float, float]:
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return mean, float('inf')
+    sem = statistics.stdev(samples) / len(samples) ** 0.5
+    return mean, tCritical(confidence, len(samples) - 1) * sem
+
+# indices of the samples whose modified z-score (based on the median absolute deviation,
+# or the mean absolute deviation when the median one is 0) exceeds the threshold, 3.5 is the usual cutoff
+def outliers(samples: List[float], threshold: float = 3.5) -> List[int]:
+    if len(samples) < 3:
+        return []
+    median = statistics.median(samples)
+    mad = statistics.median([abs(x - median) for x in samples])
+    if mad == 0:
+        # more than half the samples are identical (e.g. counts), score with the mean absolute deviation instead
+        meanad = statistics.mean([abs(x - median) for x in samples])
+        if meanad == 0: return []
+        return [i for i, x in enumerate(samples) if abs(x - median) / (1.253314 * meanad) > threshold]
+    return [i for i, x in enumerate(samples) if 0.6745 * abs(x - median) / mad > threshold]
@@ -13,13 +13,24 @@ import argparse
 import re
 import itertools as it
 import time
+import functools
+import contextlib
+import statistics
 from typing import List, Callable, Iterable, Dict, Any
 from dataclasses import dataclass
 import subprocess
+import hugepages
+import resctrl
+import topology
+import precision
 
 
+# the hardware is probed on first use (and cached) rather than at import,
+# so that pset can be imported on machines without CAT, e.g. to re-extract features offline
+
 # read getconf to get the number of L3 cache ways
 # Note: getconf -a | grep CACHE reports the correct cache sizes on octomore
+@functools.cache
 def _get_l3_assoc():
     getconf = subprocess.Popen(['getconf', '-a'], stdout=subprocess.PIPE)
     grep = subprocess.Popen(['grep', 'LEVEL3_CACHE_ASSOC'], stdin=getconf.stdout, stdout=subprocess.PIPE)
@@ -33,25 +44,39 @@ def _get_l3_assoc():
         err(f"failed to parse: {output}")
         exit(1)
 
-L3_CACHE_WAYS = _get_l3_assoc()
-
-# read the number of Class of Service definitions available
-def _get_num_COS():
+# read the number of Class of Service definitions available for a pqos technology
+# (the "Num COS" line below its heading in pqos -d)
+def _get_pqos_COS(heading: str):
     pqos_info = subprocess.Popen(['pqos', '-d'], stdout=subprocess.PIPE)
-    grep_l3 = subprocess.Popen(['grep', '-A2', 'L3 CAT'], stdin=pqos_info.stdout, stdout=subprocess.PIPE)
+    grep_l3 = subprocess.Popen(['grep', '-A2', heading], stdin=pqos_info.stdout, stdout=subprocess.PIPE)
     grep_cos = subprocess.Popen(['grep', 'Num COS'], stdin=grep_l3.stdout, stdout=subprocess.PIPE)
 
     pqos_info.stdout.close()
     grep_l3.stdout.close()
     output = grep_cos.communicate()[0].split()
 
-    if len(output) == 3:
+    if len(output) >= 3:
         return int(output[2])
     else:
-        err("could not determine number of Classes of Service through pqos")
+        err(f"could not determine number of {heading} Classes of Service through pqos")
         exit(1)
 
-NUM_COS = _get_num_COS()
+@functools.cache
+def _get_num_COS():
+    return _get_pqos_COS('L3 CAT')
+
+# MBA usually has fewer classes than CAT
+@functools.cache
+def _get_num_MBA_COS():
+    return _get_pqos_COS('Memory Bandwidth Allocation')
+
+# L3_CACHE_WAYS and NUM_COS (and NUM_MBA_COS) are still available as module attributes
+def __getattr__(name):
+    match name:
+        case 'L3_CACHE_WAYS': return _get_l3_assoc()
+        case 'NUM_COS': return _get_num_COS()
+        case 'NUM_MBA_COS': return _get_num_MBA_COS()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def err(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -82,15 +107,70 @@ class Extracted(Feature):
     regex: str      # pattern to look for in a line of stdout
     group: int
 
+@dataclass
+class Backing(Feature):
+    """Memory backing reported in the stdout of the synthetic benchmarks"""
+    pass
+
+@dataclass
+class Monitored(Feature):
+    """Feature sampled from a resctrl monitoring group (CMT/MBM) during the run"""
+    event: str      # llc_occupancy, mbm_total_bytes or mbm_local_bytes
+
+# levels of memory backing reported by rpd/randpd ("memory backing: <kind>")
+# the Backing feature records the level so that weaker backings compare lower
+BACKING_LEVELS = {'base': 0, 'thp': 1, 'hugetlb': 2}
+
+# parse the value of a perf event from the output of perf stat, None if it is not there
+def perfValue(text: str, name: str):
+    vals = [line.split()[0] for line in text.splitlines() if name in line.split()]
+    if not vals: return None
+    val = re.sub(',', '', vals[0])
+    return float(val) if '.' in val else int(val)     # e.g. task-clock is in msec
+
+# the first number captured by the regex group in a line of the text, None if no line matches
+#   note: ***assumes that you are capturing numbers***
+def extractValue(text: str, regex: str, group: int):
+    for line in text.splitlines():
+        m = re.search(regex, line)
+        if m:
+            return float(m.group(group))  # here assume number
+    return None
+
+# level of the memory backing reported in the text (see BACKING_LEVELS), None if not reported
+def backingLevel(text: str):
+    m = re.search(r"memory backing: (\w+)", text)
+    return BACKING_LEVELS[m.group(1)] if m else None
+
+def _read(path: str) -> str:
+    with open(path, 'r') as f:
+        return f.read()
+
 def timestamp() -> int:
     return int(time.time_ns())
 
+# phases of ProgramSet.run that are timed, in the order they happen
+SPANS = ['commands', 'hugepages', 'script', 'info', 'execute', 'collect', 'archive']
+
+# time a block of code, adding its duration (in seconds) to spans[name]
+@contextlib.contextmanager
+def span(spans: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0) + time.perf_counter() - start
+
 # create a Program using a command string, or a list of command strings (that will run concurrently)
+#
+# memory is the number of bytes each command maps with hugepages
+# (used to check that the hugepage pools can hold the ProgramSet before launch)
 @dataclass
 class Program:
-    def __init__(self, commands: str | Iterable[str], label: str):  #"|" is a hint of union
+    def __init__(self, commands: str | Iterable[str], label: str, memory: int = 0):  #"|" is a hint of union
         self.commands = [commands] if type(commands) == str else commands
         self.label = label
+        self.memory = memory
 
     # allows object descriptor to be placed within a string (and evaluated)
     def __repr__(self):
@@ -104,6 +184,7 @@ class Execution:
     stdout: str
     stderr: str
     perfout: str
+    node: int = None    # NUMA node the memory is bound to, if any
 
 # ProgramSet defines a list of apps to run concurrently and a set of features to extract from each execution
 #
@@ -118,18 +199,134 @@ class ProgramSet:
         self.features = []
         self.setCpus(cpus)
         self.autoAssignCAT = False  # flag, set to true if the cache should be divided equally among cores
-
+        self.mba = None             # MBA throttle levels (see setMBA), None if memory bandwidth is not throttled
+        self.hugepages = False      # flag, set to true if the hugepage pools should be checked before running
+        self.reserveHugepages = False   # flag, set to true if missing hugepages should be reserved instead of rejecting the run
+        self.resctrlRoot = "/sys/fs/resctrl"    # where resctrl is mounted, for the monitored features
+        self.monitorInterval = 0.1              # seconds between samples of the monitored features
+        self.monitor = None                     # the ResctrlMonitor of the last run
+        self.placement = None       # cpu placement policy (see setPlacement), None to take cpus in order
+        self.bindMemory = False     # flag, set to true if memory should be bound to each cpu's NUMA node
+        self.cpuTopology = None     # topology.Cpu of each online cpu, read by setPlacement
+        self.lastPlacement = []     # cpus given to each program in the last run
+        self.lastExecutions = []    # execution groups of the last run
+        self.freqReference = None   # expected effective frequency (GHz) of each run, see checkFrequency
+        self.freqTolerance = None   # allowed relative deviation from freqReference, None if not checked
+        self.archive = None         # archive.Archive to store every run in, see setArchive
+        self.keepFiles = True       # flag, set to false to delete a run's output files once it is archived
+        self.lastRunId = None       # archive id of the last run
+        self.lastExitStatus = None  # exit status of the script of the last run (as returned by os.system)
+        self.timing = False         # flag, set to true to add the duration of each phase of a run to its metrics
+        self.lastSpans = dict()     # seconds spent in each phase (see SPANS) of the last run
+        self.spanTotals = dict()    # seconds spent in each phase over all runs, see overheadReport
+        self.timedRuns = 0          # number of runs in spanTotals
+
+    # state left by the last runs, not part of the experiment definition
+    RUNTIME_STATE = ['monitor', 'cpuTopology', 'lastPlacement', 'lastExecutions', 'lastRunId', 'lastExitStatus',
+                     'lastSpans', 'spanTotals', 'timedRuns', 'archive']
+
+    # the experiment definition (this is what the .info file of a run holds, see writeInfo)
     def __repr__(self):
-        return "%s(%r)" % (self.__class__, self.__dict__)
+        return "%s(%r)" % (self.__class__, {k: v for k, v in self.__dict__.items() if k not in self.RUNTIME_STATE})
 
     # the lambda is first arg to map; this creates a list of feature names
     def feats(self):
         return list(map(lambda f: f.name, self.features))
 
+    # the parameters of this program set as plain data (no functions or objects)
+    # two program sets with the same config run the same experiment
+    def config(self) -> Dict[str, Any]:
+        def describe(f):
+            d = {'kind': type(f).__name__, 'name': f.name, 'combiner': getattr(f.combiner, '__name__', repr(f.combiner))}
+            match f:
+                case Extracted(_, _, regex, group): d |= {'regex': regex, 'group': group}
+                case Computed(_, _, _, args): d |= {'args': list(args)}
+                case Monitored(_, _, event): d |= {'event': event}
+            return d
+        return {
+            'programs': [{'label': p.label, 'commands': list(p.commands), 'memory': p.memory} for p in self.programs],
+            'cpus': self.cpus,
+            'timeout': self.timeout,
+            'features': [describe(f) for f in self.features],
+            'autoCAT': self.autoAssignCAT,
+            'mba': {str(k): v for k, v in self.mba.items()} if type(self.mba) == dict else self.mba,
+            'placement': self.placement,
+            'bindMemory': self.bindMemory,
+            'hugepages': self.hugepages,
+            'reserveHugepages': self.reserveHugepages,
+            'resctrlRoot': self.resctrlRoot,
+            'monitorInterval': self.monitorInterval,
+            'timing': self.timing,
+        }
+
 
     # set flag to false/true whether you want to automatically assign CAT masks in the created script
     def setAutoCAT(self, flag): self.autoAssignCAT = flag
 
+    # set Memory Bandwidth Allocation throttle levels (percent of the max bandwidth) in the created script
+    # levels is either
+    #   an int - the level for every core
+    #   a dict - keyed by program label (per program) and/or by cpu (per core),
+    #            cores not found in the dict are not throttled
+    #   None   - disable MBA
+    #
+    # example:
+    #   ps.setMBA({"noisy": 20})    # cap the program labeled "noisy" at 20% bandwidth
+    #
+    # the level each program ran with is recorded as the "mba" feature
+    def setMBA(self, levels: int | Dict[str | int, int] | None):
+        values = [] if levels is None else [levels] if type(levels) == int else levels.values()
+        if not all(map(lambda v: 1 <= v <= 100, values)):
+            err("(MBA error) throttle levels must be percentages between 1 and 100")
+            exit(1)
+        self.mba = levels
+
+    # MBA level of the core running a thread of the labeled program, None if unthrottled
+    def mbaLevel(self, label: str, cpu: int):
+        match self.mba:
+            case None: return None
+            case int(level): return level
+            case dict(levels): return levels.get(label, levels.get(cpu))
+
+    # set flag to check the hugepage pools before each run
+    # if reserve is set, grow the pools of nodes that are short instead of rejecting the run
+    # the memory backing each program actually got is recorded as the "backing" feature
+    def setHugepages(self, flag, reserve = False):
+        self.hugepages = flag
+        self.reserveHugepages = reserve
+        if flag: self.recordBacking()
+
+    # place program threads on cpus according to the machine topology
+    # policy is one of topology.POLICIES (linear, compact, spread, avoid-smt, same-llc, different-llc, different-node)
+    # only cpus given to setCpus are used, or all online cpus if none were given
+    # if bindMemory is set, each thread's memory is bound to its cpu's NUMA node with numactl
+    #
+    # the cpus chosen for each program are recorded as the "placement" feature
+    def setPlacement(self, policy: str, bindMemory = False):
+        if policy not in topology.POLICIES:
+            err("unknown placement policy", policy, "expected one of", *topology.POLICIES)
+            exit(1)
+        self.placement = policy
+        self.bindMemory = bindMemory
+        self.cpuTopology = topology.readTopology()
+
+    # store every run (config, placement, CAT/MBA state, outputs and features) in an archive
+    # unless keepFiles is set, the output files of a run are deleted once it is archived
+    #
+    # example:
+    #   ps.setArchive(Archive("l3contention.db"))
+    def setArchive(self, archive, keepFiles = False):
+        self.archive = archive
+        self.keepFiles = keepFiles
+
+    # add the time pset spent in each phase of a run to the metrics of every program:
+    #   span-<phase> - seconds spent in the phase (the same for all programs of the run)
+    #   elapsed      - the program's measured window, the longest "seconds time elapsed" reported by perf
+    #   overhead     - seconds of the execute phase outside of the longest measured window
+    #                  (shell, taskset/perf/timeout startup, pqos calls)
+    # the archive phase ends after the run is stored, so its span is only in the returned metrics
+    def setTiming(self, flag): self.timing = flag
+
     def setCpus(self, cpus: Iterable[int]):
         self.cpus = sorted([*set(cpus)])
 
@@ -145,6 +342,37 @@ class ProgramSet:
         if f not in self.features:  # won't add same event twice
             self.features.insert(0, f)
 
+    # compute each program's effective frequency in GHz (cycles per task-clock) as the "ghz" feature
+    # runUntilPrecise rejects runs whose "ghz" is off from the reference by more than tolerance
+    # if reference is None, the first run of runUntilPrecise sets it
+    def checkFrequency(self, reference: float = None, tolerance: float = 0.05):
+        for event in ["cycles", "task-clock"]:
+            if event not in self.feats(): self.addEvent(event)
+        if "ghz" not in self.feats():
+            # task-clock is in msec
+            # the slowest thread of a program is its frequency
+            self.computeFeature("ghz", lambda cycles, ms: cycles / ms / 1e6, "cycles", "task-clock", combiner = min)
+        self.freqReference = reference
+        self.freqTolerance = tolerance
+
+    # sample a resctrl monitoring event (CMT/MBM) for each program during the run
+    # params:
+    #   event - one of llc_occupancy, mbm_total_bytes, mbm_local_bytes
+    #   combiner - function to combine the totals of several threads/executions
+    #
+    # each program also gets an "<event>-series" entry with the time series
+    # of the event summed over its threads (see resctrl.py for the units)
+    #
+    # monitoring cannot be combined with CAT/MBA: pqos moves the cores to other resctrl
+    # control groups, out of the monitoring groups, which would then read ~0
+    def addMonitor(self, event: str, combiner = sum):
+        if event not in resctrl.MON_EVENTS:
+            err("unknown monitoring event", event, "expected one of", *resctrl.MON_EVENTS)
+            exit(1)
+        f = Monitored(event, combiner, event)
+        if f not in self.features:
+            self.features.append(f)
+
     # define a feature that is computed from several other features
     #
     # example:
@@ -173,16 +401,40 @@ class ProgramSet:
         for name, group in group_names.items():
             self.features.append(Extracted(name, combiner, pattern, group))
 
+    # record the memory backing (hugetlb, thp or base) reported by the programs
+    # the minimum level over a program's threads is kept, i.e. its weakest backing
+    def recordBacking(self):
+        f = Backing("backing", min)
+        if f not in self.features:
+            self.features.append(f)
+
+    # choose the cpus of each program's threads
+    # without a placement policy cpus are taken off the cpu list in order
+    def placePrograms(self) -> List[List[int]]:
+        sizes = [len(p.commands) for p in self.programs]
+        if self.placement is None:
+            # takes off first x cpus off the list
+            def take(x, lst):
+                return [lst.pop(0) if lst else None for _ in range(x)]
+            cpus = self.cpus.copy()
+            return [take(x, cpus) for x in sizes]
+
+        allowed = [c for c in self.cpuTopology if not self.cpus or c.id in self.cpus]
+        placement = topology.allocate(allowed, sizes, self.placement)
+        if placement is None:
+            err(f"not enough cpus to place {sizes} threads with the {self.placement} policy")
+            exit(1)
+        return [[c.id for c in cpus] for cpus in placement]
+
+    # NUMA node of a cpu, from the topology read by setPlacement
+    def cpuNode(self, cpu: int) -> int:
+        return next(c.node for c in self.cpuTopology if c.id == cpu)
+
     # assign cpu and output filenames to each program thread
     def createCommands(self, stamp) -> List[List[Execution]]:
-        # takes off first x cpus off the list
-        def take(x, lst):
-            return [lst.pop(0) if lst else None for _ in range(x)]
-
         seen_labels = dict()
         execs = []
-        cpus = self.cpus.copy()
-        for p in self.programs:
+        for p, cpus_to_use in zip(self.programs, self.placePrograms()):
             prefix = f"{self.dir}/{stamp}-{p.label}"
             x = seen_labels.get(p.label)
             if not x:
@@ -194,56 +446,94 @@ class ProgramSet:
             # this avoids using extracted features as perf events
             perf_events = [f.name for f in self.features if isinstance(f, PerfCounter)]
             timeout = f"timeout {self.timeout}" if self.timeout else ""
-            # cpus_to_use is a list
-            cpus_to_use = take(len(p.commands), cpus)
 
             # for each execution, create its command string
             exec_group = []
             # it is itertools library; this creates an iterator that goes 1 to infinity
             for (i, cpu, comm) in zip(it.count(1), cpus_to_use, p.commands):
-                taskset = f"taskset -c {cpu}" if cpu else (err("not enough cpus"), exit(1))
+                taskset = f"taskset -c {cpu}" if cpu is not None else (err("not enough cpus"), exit(1))
+                node = self.cpuNode(cpu) if self.bindMemory else None
+                numactl = f"numactl --membind={node}" if self.bindMemory else ""
                 sub_prefix = prefix + (f"-i{i}" if len(p.commands) > 1 else "")
                 stdout = sub_prefix + ".out"
                 stderr = sub_prefix + ".err"
                 perfout = sub_prefix + ".perf"
                 perf = f"perf stat -o {perfout} --no-big-num -e {','.join(perf_events)}" if perf_events else ""
-                commandStr = f"{taskset} {perf} {timeout} {comm} >{stdout} 2>{stderr}".strip()
+                commandStr = f"{taskset} {numactl} {perf} {timeout} {comm} >{stdout} 2>{stderr}".strip()
                 # exec_group is a list of executions to run concurrently
-                exec_group.append(Execution(commandStr, cpu=cpu, stdout=stdout, stderr=stderr, perfout=perfout))
+                exec_group.append(Execution(commandStr, cpu=cpu, stdout=stdout, stderr=stderr, perfout=perfout, node=node))
             execs.append(exec_group)
         return execs
 
-    # write the script to execute this program set
-    # return the filename of the script
-    def createScript(self, stamp, execs = None) -> str:
-        execs = self.createCommands(stamp) if not execs else execs
-        script = open(f"{stamp}.sh", 'w')
-        def line(content):
-            script.write(content + '\n')
+    # put the cores in Classes of Service, which hold both a CAT mask and an MBA level
+    # cores with the same mask and level share a class, cores with neither stay in the default class 0
+    # return a list of (class, cpu, CAT mask, MBA level) for the cores in a class, where mask/level are None if unset
+    # (an empty list if neither CAT nor MBA is used)
+    def allocateCOS(self, execs : List[List[Execution]]):
+        if not self.autoAssignCAT and self.mba is None:
+            return []
 
         cpus = [exec_.cpu for exec_group in execs for exec_ in exec_group]
-
-        line("#!/bin/bash")
+        labels = [p.label for p, exec_group in zip(self.programs, execs) for _ in exec_group]
 
         # assign CAT masks to divide cache equally among cores
         def assignCAT(items):
             numItems = len(items)
-            if numItems > NUM_COS - 1:
-                err("(CAT error) not enough Classes of Service for the number of cores being used")
-                exit(1)
-            waysPerItem = L3_CACHE_WAYS // numItems
+            waysPerItem = _get_l3_assoc() // numItems
             # create the binary string for the CAT bitmask
             # the "2" means the base of the number string; convert to int
             # note that when i == 0, will get just a 1; i == 1, get 10, etc.
             def mkMask(i): return int('1'*waysPerItem + '0'*i*waysPerItem, 2)
             return [mkMask(i) for i in range(numItems)]
 
+        # every core gets its own CAT mask, and with it its own class and at least one way of the cache
+        if self.autoAssignCAT:
+            if len(cpus) > _get_num_COS() - 1:
+                err("(CAT error) not enough Classes of Service for the number of cores being used")
+                exit(1)
+            if len(cpus) > _get_l3_assoc():
+                err(f"(CAT error) {len(cpus)} cores cannot each get a way of the {_get_l3_assoc()}-way L3 cache")
+                exit(1)
+
         # TODO give option to divide cache by core or by program
         # it is probably just better overall to manually set CAT classes
-        if self.autoAssignCAT:
-            for clazz, cpu, catMask in zip(it.count(1), cpus, assignCAT(cpus)):
-                line(f"pqos -e 'llc:{clazz}={catMask}'")
-                line(f"pqos -a 'llc:{clazz}={cpu}'")
+        catMasks = assignCAT(cpus) if self.autoAssignCAT else [None]*len(cpus)
+        levels = [self.mbaLevel(label, cpu) for label, cpu in zip(labels, cpus)]
+        settings = list(zip(catMasks, levels))
+        classes = dict()
+        for setting in settings:
+            if setting != (None, None) and setting not in classes:
+                classes[setting] = len(classes) + 1
+
+        # class 0 is the default class, so one fewer is available for each technology in use
+        available = []
+        if self.autoAssignCAT: available.append(("CAT", _get_num_COS()))
+        if any(level is not None for level in levels): available.append(("MBA", _get_num_MBA_COS()))
+        for technology, numCOS in available:
+            if len(classes) > numCOS - 1:
+                err(f"(CAT/MBA error) {len(classes)} Classes of Service are needed but {technology} "
+                    f"only has {numCOS - 1} besides the default class")
+                exit(1)
+        return [(classes[setting], cpu, *setting) for cpu, setting in zip(cpus, settings) if setting in classes]
+
+    # write the script to execute this program set
+    # return the filename of the script
+    def createScript(self, stamp, execs = None) -> str:
+        execs = self.createCommands(stamp) if not execs else execs
+        script = open(f"{stamp}.sh", 'w')
+        def line(content):
+            script.write(content + '\n')
+
+        line("#!/bin/bash")
+
+        allocation = self.allocateCOS(execs)
+        defined = set()
+        for clazz, cpu, catMask, level in allocation:
+            if clazz not in defined:
+                if catMask is not None: line(f"pqos -e 'llc:{clazz}={catMask}'")
+                if level is not None: line(f"pqos -e 'mba:{clazz}={level}'")
+                defined.add(clazz)
+            line(f"pqos -a 'llc:{clazz}={cpu}'")
 
         # array to capture pids to later wait for all to be done
         # explicit way to implement waiting for all
@@ -256,12 +546,84 @@ class ProgramSet:
         total_processes = sum(map(lambda exe: len(exe), execs))
         line(''.join(["wait ${pids[" + str(i) + "]}\n" for i in range(total_processes)]))
 
-        # clean up cache allocations
-        if self.autoAssignCAT: line("pqos -R")
+        # clean up cache and bandwidth allocations
+        if allocation: line("pqos -R")
 
         script.close()
         return script.name
 
+    # check that the hugepages needed by the executions fit in the pools of their NUMA nodes
+    # reserve the missing pages if allowed, otherwise reject the run
+    def planHugepages(self, execs : List[List[Execution]]):
+        size = hugepages.pageSize()
+        demand = dict()
+        for p, group in zip(self.programs, execs):
+            for exe in group:
+                node = hugepages.cpuNode(exe.cpu)
+                demand[node] = demand.get(node, 0) + hugepages.pagesFor(p.memory, size)
+
+        pools = hugepages.nodePools(size)
+        missing = hugepages.shortfall(demand, pools)
+        if missing and self.reserveHugepages:
+            for node, pages in missing.items():
+                print(f"reserving {pages} hugepages on node {node}")
+                pools[node] = hugepages.reserve(node, pages, size)
+            missing = hugepages.shortfall(demand, pools)
+
+        if missing:
+            for node, pages in missing.items():
+                err(f"(hugepage error) node {node} needs {demand[node]} hugepages of {size} bytes "
+                    f"but only {demand[node] - pages} are free")
+            exit(1)
+
+    # warn about programs that did not get hugetlb backing,
+    # their samples may include TLB effects that a clean run would not have
+    def checkBacking(self, stats):
+        for p, stat in zip(self.programs, stats):
+            if stat.get("backing", BACKING_LEVELS['hugetlb']) < BACKING_LEVELS['hugetlb']:
+                level = [k for k, v in BACKING_LEVELS.items() if v == stat["backing"]][0]
+                err(f"(hugepage warning) {p.label} ran with {level} backing instead of hugetlb")
+
+    # name of the resctrl monitoring group of an execution (its output prefix without the directory)
+    def monitorGroup(self, execution : Execution):
+        return os.path.splitext(os.path.basename(execution.stdout))[0]
+
+    # create a resctrl monitoring group for each execution
+    def createMonitor(self, execs : List[List[Execution]]) -> resctrl.ResctrlMonitor:
+        if self.allocateCOS(execs):
+            err("(resctrl error) monitored features cannot be used with CAT/MBA, "
+                "pqos moves the cores out of the monitoring groups")
+            exit(1)
+        if not os.path.isdir(f"{self.resctrlRoot}/mon_groups"):
+            err(f"(resctrl error) no monitoring support found at {self.resctrlRoot}, is resctrl mounted?")
+            exit(1)
+        monitor = resctrl.ResctrlMonitor(self.resctrlRoot, self.monitorInterval)
+        for exe in it.chain(*execs):
+            monitor.add(self.monitorGroup(exe), [exe.cpu])
+        return monitor
+
+    # record the MBA level each program ran with, the tightest level over its threads
+    # (100 if none of its cores were throttled)
+    def recordMBA(self, stats, execs : List[List[Execution]]):
+        for p, group, stat in zip(self.programs, execs, stats):
+            levels = [self.mbaLevel(p.label, exe.cpu) for exe in group]
+            stat["mba"] = min([100] + [l for l in levels if l is not None])
+
+    # record the cpus each program ran on (and the nodes its memory was bound to)
+    def recordPlacement(self, stats, execs : List[List[Execution]]):
+        for group, stat in zip(execs, stats):
+            stat["placement"] = ','.join(str(exe.cpu) for exe in group)
+            if self.bindMemory:
+                stat["membind"] = ','.join(str(exe.node) for exe in group)
+
+    # remove the files produced by a run
+    def removeFiles(self, stamp, execs : List[List[Execution]]):
+        for exe in it.chain(*execs):
+            for path in [exe.stdout, exe.stderr, exe.perfout]:
+                if os.path.exists(path): os.remove(path)
+        for path in [f"{stamp}.sh", f"{self.dir}/{stamp}.info"]:
+            if os.path.exists(path): os.remove(path)
+
     # write out the parameters of this program set
     def writeInfo(self, stamp):
         info = open(f"{self.dir}/{stamp}.info", 'w')
@@ -278,47 +640,220 @@ class ProgramSet:
         for feature in self.features:
             match feature:
                 case PerfCounter(name):
-                    pfile = open(execution.perfout, 'r')
-                    val = [line.split()[0] for line in pfile.readlines() if name in line.split()][0]
-                    pfile.close()
-                    stat[name] = int(re.sub(',', '', val))
+                    stat[name] = perfValue(_read(execution.perfout), name)
                 case Extracted(name, _, regex, group):
-                    ofile = open(execution.stdout, 'r')
-                    for line in ofile.readlines():
-                        m = re.search(regex, line)
-                        if m:
-                            stat[name] = float(m.group(group))  # here assume number
-                            break
-                    ofile.close()
+                    val = extractValue(_read(execution.stdout), regex, group)
+                    if val is not None: stat[name] = val
+                case Backing(name):
+                    level = backingLevel(_read(execution.stdout))
+                    if level is None:
+                        err(f"no memory backing reported in {execution.stdout}, assuming base pages")
+                    stat[name] = level if level is not None else BACKING_LEVELS['base']
+                case Monitored(name, _, event):
+                    stat[name] = self.monitor.total([self.monitorGroup(execution)], event)
+        return self.computeFeatures(stat)
+
+    # add the computed features to the features of one execution
+    # (the features a computed feature uses are always defined before it)
+    def computeFeatures(self, stat):
+        for feature in self.features:
+            match feature:
                 case Computed(name, _, f, args):
                     # args is feature name, *map means variable # args, passed to f
                     stat[name] = f(*map(lambda a: stat[a], args))
         return stat
 
+    # combine the features of several executions (of one program) into program-level metrics
+    def combineStats(self, stats):
+        return {feat.name : feat.combiner(map(lambda stat: stat[feat.name], stats)) for feat in self.features}
+
     # given one execution group (one 'program'),
     # collect each 'thread's features from its produced output files
     # combine the features into single program-level metrics
     def collectStats(self, execs : List[Execution]):
         stats = list(map(self.getFeatures, execs))
         # combine from all instances
-        return {feat.name : feat.combiner(map(lambda stat: stat[feat.name], stats)) for feat in self.features}
+        combined = self.combineStats(stats)
+        # monitored features also come with their time series, summed over the instances
+        groups = [self.monitorGroup(exe) for exe in execs]
+        for feat in self.features:
+            if isinstance(feat, Monitored):
+                combined[feat.name + "-series"] = self.monitor.series(groups, feat.event)
+        return combined
 
 
     # create a script for this program set
     # run it
     # return the collected metrics as a list of dictionaries
     # where item i is collected metrics for program i
-    def run(self, stamp="nickwinsten"):
-        path = os.getcwd() + "/" + self.dir
-        if not os.path.exists(path):
-            os.makedirs(path)
-        execution_groups = self.createCommands(stamp)
-        script = self.createScript(stamp, execution_groups)
-        self.writeInfo(stamp)
+    #
+    # params are extra parameters describing the run (e.g. {"delayX": 3}),
+    # they are stored with it if an archive is set
+    def run(self, stamp="nickwinsten", params: Dict[str, Any] = None):
+        spans = dict()
+        with span(spans, "commands"):
+            path = os.getcwd() + "/" + self.dir
+            if not os.path.exists(path):
+                os.makedirs(path)
+            execution_groups = self.createCommands(stamp)
+            self.lastPlacement = [[exe.cpu for exe in group] for group in execution_groups]
+            self.lastExecutions = execution_groups
+        if self.hugepages:
+            with span(spans, "hugepages"): self.planHugepages(execution_groups)
+        with span(spans, "script"): script = self.createScript(stamp, execution_groups)
+        with span(spans, "info"): self.writeInfo(stamp)
         print(f"created script {script}")
         print("running...")
-        os.system(f"chmod a+x {script}")
-        exit_status = os.system(f"./{script}")
+        with span(spans, "execute"):
+            os.system(f"chmod a+x {script}")
+            monitored = any(isinstance(f, Monitored) for f in self.features)
+            if monitored:
+                self.monitor = self.createMonitor(execution_groups)
+                self.monitor.start()
+            exit_status = os.system(f"./{script}")
+            self.lastExitStatus = exit_status
+            if monitored: self.monitor.stop()
         print("exit status:", exit_status & 0xff)
 
-        return list(map(self.collectStats, execution_groups))
+        with span(spans, "collect"):
+            stats = list(map(self.collectStats, execution_groups))
+            if monitored: self.monitor.remove()
+            if self.hugepages: self.checkBacking(stats)
+            if self.mba is not None: self.recordMBA(stats, execution_groups)
+            self.recordPlacement(stats, execution_groups)
+        if self.timing: self.recordSpans(stats, execution_groups, spans)
+
+        if self.archive:
+            with span(spans, "archive"):
+                self.lastRunId = self.archive.record(self, stamp, execution_groups, stats, exit_status, params,
+                                                     fingerprint = topology.fingerprint())
+                if not self.keepFiles: self.removeFiles(stamp, execution_groups)
+            print("archived as", self.lastRunId)
+            if self.timing:
+                for stat in stats: stat["span-archive"] = spans["archive"]
+
+        self.lastSpans = spans
+        for name, seconds in spans.items():
+            self.spanTotals[name] = self.spanTotals.get(name, 0) + seconds
+        self.timedRuns += 1
+        return stats
+
+    # the measured window of each program: the longest time perf reports for its executions
+    # (None for programs run without perf events)
+    def measuredWindows(self, execs : List[List[Execution]]):
+        windows = []
+        for group in execs:
+            elapsed = [perfValue(_read(exe.perfout), "elapsed") for exe in group if os.path.exists(exe.perfout)]
+            elapsed = [e for e in elapsed if e is not None]
+            windows.append(max(elapsed) if elapsed else None)
+        return windows
+
+    # add the spans of a run, the measured window of each program and the overhead of the run to its metrics
+    # (see setTiming)
+    def recordSpans(self, stats, execs : List[List[Execution]], spans: Dict[str, float]):
+        windows = self.measuredWindows(execs)
+        measured = max([w for w in windows if w is not None], default=None)
+        overhead = spans["execute"] - measured if measured is not None else None
+        for stat, window in zip(stats, windows):
+            for name in SPANS:
+                if name in spans: stat[f"span-{name}"] = spans[name]
+            stat["elapsed"] = window
+            stat["overhead"] = overhead
+        if measured is not None:
+            self.spanTotals["measured"] = self.spanTotals.get("measured", 0) + measured
+
+    # summary of where the wall clock time of the runs so far went, one line per phase
+    # and, if setTiming was on, the measured windows and the harness time outside of them
+    #
+    # example:
+    #   ps.setTiming(True)
+    #   for delay in range(10): ps.run(f"d{delay}")
+    #   print(ps.overheadReport())
+    def overheadReport(self) -> str:
+        runs = max(self.timedRuns, 1)
+        wall = sum(self.spanTotals.get(name, 0) for name in SPANS)
+        share = lambda seconds: seconds / wall if wall else 0
+        lines = [f"pset time over {self.timedRuns} runs: {wall:.3f} s",
+                 f"{'phase':<12}{'total s':>10}{'ms/run':>10}{'share':>8}"]
+        for name in SPANS:
+            if name in self.spanTotals:
+                seconds = self.spanTotals[name]
+                lines.append(f"{name:<12}{seconds:>10.3f}{1000*seconds/runs:>10.2f}{share(seconds):>8.1%}")
+        if "measured" in self.spanTotals:
+            measured = self.spanTotals["measured"]
+            lines.append(f"{'measured':<12}{measured:>10.3f}{1000*measured/runs:>10.2f}{share(measured):>8.1%}")
+            lines.append(f"{'harness':<12}{wall - measured:>10.3f}{1000*(wall - measured)/runs:>10.2f}"
+                         f"{share(wall - measured):>8.1%}")
+        return '\n'.join(lines)
+
+    # repeat runs until the relative confidence interval of a feature drops below target
+    # params:
+    #   feature - name of the feature to estimate
+    #   program - index (or label) of the program the feature is taken from
+    #   target - relative half width of the confidence interval to reach, e.g. 0.02 for +-2%
+    #   minReps, maxReps - bounds on the number of kept runs
+    #   confidence - confidence level of the interval, one of precision.T_CONFIDENCES
+    #
+    # outliers (by median absolute deviation) are left out of the estimate,
+    # and if checkFrequency was called, runs whose frequency drifted are thrown away and repeated
+    # (at most maxReps of them)
+    # returns a precision.Estimate with the mean, CI, number of repetitions and kept runs
+    #
+    # example:
+    #   est = ps.runUntilPrecise("progress", program=0, target=0.01)
+    def runUntilPrecise(self, feature: str, program: int | str = 0, target: float = 0.02,
+                        minReps = 3, maxReps = 30, confidence = 0.95, stamp = "nickwinsten") -> precision.Estimate:
+        if confidence not in precision.T_CONFIDENCES:
+            err(f"(precision error) confidence must be one of {precision.T_CONFIDENCES}")
+            exit(1)
+        if type(program) == str:
+            program = [p.label for p in self.programs].index(program)
+        samples, runs, drifted = [], [], 0
+        reference = self.freqReference
+
+        def estimate():
+            if not samples:
+                return precision.Estimate(float('nan'), float('inf'), float('inf'), 0, drifted)
+            drop = precision.outliers(samples)
+            kept = [x for i, x in enumerate(samples) if i not in drop]
+            mean, ci = precision.confidenceInterval(kept, confidence)
+            relci = ci / abs(mean) if mean else float('inf')
+            return precision.Estimate(mean, ci, relci, len(kept), drifted + len(drop), kept,
+                                      [r for i, r in enumerate(runs) if i not in drop])
+
+        for rep in it.count(1):
+            stats = self.run(f"{stamp}-rep{rep}")
+
+            if self.freqTolerance is not None:
+                ghz = [stat["ghz"] for stat in stats]
+                reference = reference if reference else statistics.median(ghz)
+                if any(abs(f / reference - 1) > self.freqTolerance for f in ghz):
+                    err(f"(frequency warning) run {rep} ran at {ghz} GHz instead of {reference:.3f} GHz, repeating it")
+                    drifted += 1
+                    if drifted >= maxReps: break
+                    continue
+
+            samples.append(stats[program][feature])
+            runs.append(stats)
+            if len(samples) >= maxReps: break
+            if len(samples) >= minReps and estimate().relci <= target: break
+
+        result = estimate()
+        print(f"{feature}: {result.mean} +- {result.ci} ({result.relci:.2%}) "
+              f"after {result.reps} runs, {result.rejected} rejected")
+        return result
+
+    # run the program set once for each MBA throttle level
+    # if label is given only that program is throttled, otherwise every core is
+    # return a list of (level, collected metrics) pairs
+    #
+    # example:
+    #   for level, [statX, statY] in ps.sweepMBA(range(10, 101, 10), "XY", label="noisy"): ...
+    def sweepMBA(self, levels: Iterable[int], stamp="nickwinsten", label: str = None):
+        previous = self.mba
+        results = []
+        for level in levels:
+            self.setMBA({label: level} if label else level)
+            results.append((level, self.run(f"{stamp}-mba{level}")))
+        self.mba = previous
+        return results
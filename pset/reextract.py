@@ -0,0 +1,191 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module re-derives the features of a ProgramSet from the outputs of runs that already happened,
+# so that a new extractFeature/computeFeature can be added to a dataset without rerunning the experiments
+#
+# The outputs can come from output directories (ps.dir, with the .info file of each run)
+# or from an archive (see archive.py). Runs are parsed in chunks by a pool of processes,
+# the computed features are then evaluated on whole columns of the chunk's table (row by row if they need numbers)
+# and the per-program table is written to a parquet (or csv) file chunk by chunk
+#
+# Monitored (resctrl) features are sampled during a run and cannot be re-extracted, they are skipped
+#
+# usage:
+#   python3 reextract.py features.py runs-data/ runs.db -o features.parquet
+# where features.py defines the ProgramSet `ps` whose features should be extracted
+# (only its features are used, its programs are read from each run)
+#
+
+import os
+import re
+import glob
+import runpy
+import argparse
+import statistics
+import itertools as it
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, Any
+
+import pandas as pd
+
+from pset import err, perfValue, extractValue, backingLevel, \
+    PerfCounter, Extracted, Backing, Computed, Monitored
+from archive import Archive
+
+# combiners that have a pandas equivalent are aggregated without calling back into python
+_AGGREGATIONS = {sum: 'sum', min: 'min', max: 'max', len: 'count', statistics.mean: 'mean'}
+
+# a run to re-extract: (source, run key), where the source is a directory or an archive path
+Run = Tuple[str, str]
+
+
+def _read(path: str) -> str:
+    with open(path, 'r') as f:
+        return f.read()
+
+# the runs left in output directories, one per .info file
+def dirRuns(dir: str) -> List[Run]:
+    return [(dir, os.path.basename(info)[:-len(".info")]) for info in sorted(glob.glob(f"{dir}/*.info"))]
+
+def archiveRuns(path: str) -> List[Run]:
+    archive = Archive(path)
+    runs = [(path, row[0]) for row in archive.db.execute("SELECT run_id FROM runs ORDER BY created")]
+    archive.close()
+    return runs
+
+# the outputs of a run in a directory as (program, label, execution, {kind: text})
+# the programs are read from the run's .info file in order, their files are named
+# <stamp>-<label>[-x<n>][-i<m>].<kind> (see ProgramSet.createCommands)
+def _dirOutputs(dir: str, stamp: str):
+    labels = re.findall(r"'label': '([^']*)'", _read(f"{dir}/{stamp}.info"))
+    seen = dict()
+    outputs = []
+    for program, label in enumerate(labels):
+        x = seen.get(label, 0)
+        seen[label] = x + 1
+        prefix = f"{dir}/{stamp}-{label}" + (f"-x{x}" if x else "")
+        files = [prefix + ".out"] if os.path.exists(prefix + ".out") else \
+            sorted(glob.glob(prefix + "-i*.out"), key=lambda f: int(re.search(r"-i(\d+)\.out$", f).group(1)))
+        for execution, out in enumerate(files):
+            base = out[:-len(".out")]
+            texts = {kind: _read(f"{base}.{kind}") for kind in ['out', 'perf'] if os.path.exists(f"{base}.{kind}")}
+            outputs.append((program, label, execution, texts))
+    return outputs
+
+def _archiveOutputs(archive: Archive, runId: str):
+    labels = [p['label'] for p in archive.run(runId)['config']['programs']]
+    return [(program, labels[program], execution, texts) for program, execution, _, texts in archive.artifacts(runId)]
+
+# worker: parse the raw features of every execution of a chunk of runs
+# specs are (kind, name, regex, group) tuples, since features with functions cannot be sent to the workers
+def _extractChunk(chunk: List[Run], specs) -> List[Dict[str, Any]]:
+    rows = []
+    archives = dict()
+    for source, key in chunk:
+        if source.endswith(".db"):
+            if source not in archives: archives[source] = Archive(source)
+            outputs = _archiveOutputs(archives[source], key)
+        else:
+            outputs = _dirOutputs(source, key)
+        for program, label, execution, texts in outputs:
+            row = {'source': source, 'run': key, 'program': program, 'label': label, 'execution': execution}
+            for kind, name, regex, group in specs:
+                match kind:
+                    case 'perf': row[name] = perfValue(texts.get('perf', ''), name)
+                    case 'extracted': row[name] = extractValue(texts.get('out', ''), regex, group)
+                    case 'backing': row[name] = backingLevel(texts.get('out', ''))
+            rows.append(row)
+    for archive in archives.values(): archive.close()
+    return rows
+
+def _specs(features) -> List[tuple]:
+    specs = []
+    for f in features:
+        match f:
+            case PerfCounter(name): specs.append(('perf', name, None, None))
+            case Extracted(name, _, regex, group): specs.append(('extracted', name, regex, group))
+            case Backing(name): specs.append(('backing', name, None, None))
+            case Monitored(name):
+                err(f"monitored feature {name} cannot be re-extracted, skipping it")
+    return specs
+
+# evaluate a computed feature over the executions table
+# the function first sees whole columns, which works for arithmetic like lambda x,y: x/y,
+# functions that only take numbers (math.log, if, min()...) are evaluated row by row instead
+def _compute(f: Computed, executions: pd.DataFrame) -> pd.Series:
+    try:
+        values = f.func(*[executions[a] for a in f.args])
+        if isinstance(values, pd.Series) and len(values) == len(executions):
+            return values
+    except (TypeError, ValueError):
+        pass
+    return executions[list(f.args)].apply(lambda row: f.func(*row), axis=1)
+
+# evaluate the computed features over the executions table and combine executions into programs
+def combine(features, executions: pd.DataFrame) -> pd.DataFrame:
+    executions = executions.copy()
+    for f in features:
+        if isinstance(f, Computed):
+            executions[f.name] = _compute(f, executions)
+
+    keys = ['source', 'run', 'program', 'label']
+    grouped = executions.groupby(keys, sort=False)
+    columns = {f.name: grouped[f.name].agg(_AGGREGATIONS.get(f.combiner, lambda s, c=f.combiner: c(s)))
+               for f in features if f.name in executions.columns}
+    return pd.DataFrame(columns).reset_index()
+
+# append a chunk of the table to a parquet or csv file
+# returns the parquet writer to use for the next chunk
+def _write(table: pd.DataFrame, out: str, writer):
+    if out.endswith(".csv"):
+        first = writer is None
+        table.to_csv(out, mode='w' if first else 'a', header=first, index=False)
+        return out
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # values become doubles so that every chunk has the same schema
+    arrow = pa.Table.from_pandas(table.astype({c: float for c in table.columns[4:]}), preserve_index=False)
+    if writer is None: writer = pq.ParquetWriter(out, arrow.schema)
+    writer.write_table(arrow)
+    return writer
+
+# re-derive the feature table of the runs in the given sources (output directories and/or archive .db files)
+# params:
+#   features - the features to extract, e.g. ps.features
+#   out - parquet file to write the table to (csv if it ends with .csv), None to only return it
+#   processes - size of the process pool (default: number of cpus)
+#   chunksize - number of runs parsed by a worker at a time
+# returns the table, one row per program of each run
+def reextract(features, sources: List[str], out: str = None, processes: int = None, chunksize: int = 64) -> pd.DataFrame:
+    runs = list(it.chain(*[archiveRuns(s) if s.endswith(".db") else dirRuns(s) for s in sources]))
+    chunks = [runs[i:i+chunksize] for i in range(0, len(runs), chunksize)]
+    specs = _specs(features)
+    print(f"re-extracting {len(features)} features from {len(runs)} runs in {len(chunks)} chunks")
+
+    writer = None
+    tables = []
+    with ProcessPoolExecutor(processes) as pool:
+        for rows in pool.map(_extractChunk, chunks, it.repeat(specs)):
+            if not rows: continue
+            table = combine(features, pd.DataFrame(rows))
+            tables.append(table)
+            if out: writer = _write(table, out, writer)
+    if hasattr(writer, 'close'): writer.close()
+
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="re-extract the features of a ProgramSet from archived runs")
+    parser.add_argument("definition", help="python file defining the ProgramSet `ps` with the features to extract")
+    parser.add_argument("sources", nargs='+', help="output directories and/or archive .db files")
+    parser.add_argument("-o", "--out", default="features.parquet", help="parquet (or .csv) file to write")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=64, help="runs per chunk")
+    args = parser.parse_args()
+
+    ps = runpy.run_path(args.definition)['ps']
+    table = reextract(ps.features, args.sources, args.out, args.processes, args.chunksize)
+    print(f"wrote {len(table)} rows to {args.out}")
@@ -0,0 +1,126 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module samples the resctrl monitoring groups (CMT/MBM) of the programs in a run
+#
+# Each monitored execution gets its own monitoring group holding the cpu it is pinned to.
+# The groups are sampled from a background thread for the duration of the run,
+# giving a time series and a total for each event:
+#   llc_occupancy   - bytes of the LLC held by the group (total is the mean occupancy)
+#   mbm_total_bytes - bytes moved to/from memory (total is the bytes moved during the run)
+#   mbm_local_bytes - same as above, restricted to the local NUMA node
+#
+# The resctrl root is a parameter so the monitor can be pointed at a fake tree for testing.
+# Note: groups are made under the root control group. Assigning the cpus to a class of service
+# (pqos -a, as CAT/MBA do) moves them to another control group and the groups would read ~0,
+# so ProgramSet refuses to monitor runs that use CAT or MBA
+#
+# Samples of a domain reporting "Unavailable" (e.g. an RMID that was recycled) are NaN, not 0
+#
+
+import os
+import sys
+import glob
+import time
+import threading
+from typing import List, Tuple, Dict
+
+MON_EVENTS = ['llc_occupancy', 'mbm_total_bytes', 'mbm_local_bytes']
+
+# events whose counters accumulate over time (as opposed to a level like occupancy)
+CUMULATIVE_EVENTS = ['mbm_total_bytes', 'mbm_local_bytes']
+
+
+class ResctrlMonitor:
+    def __init__(self, root: str = "/sys/fs/resctrl", interval: float = 0.1):
+        self.root = root
+        self.interval = interval
+        self.groups = dict()    # group name -> list of cpus
+        self.samples = []       # list of (time, {group: {event: value}})
+        self.unavailable = set()    # (group, event) pairs that had unavailable samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__, self.__dict__)
+
+    def _groupDir(self, name):
+        return f"{self.root}/mon_groups/{name}"
+
+    # create a monitoring group counting everything that runs on the given cpus
+    def add(self, name: str, cpus: List[int]):
+        d = self._groupDir(name)
+        os.makedirs(d, exist_ok=True)
+        with open(f"{d}/cpus_list", 'w') as f:
+            f.write(','.join(map(str, cpus)))
+        if not glob.glob(f"{d}/mon_data/mon_L3_*"):
+            print(f"(resctrl error) group {d} has no mon_data/mon_L3_* domains, is L3 monitoring supported?",
+                  file=sys.stderr)
+            self.groups[name] = cpus
+            self.remove()
+            exit(1)
+        self.groups[name] = cpus
+
+    # read an event of a group, summed over all L3 domains
+    # NaN if a domain reports "Unavailable" (warned about once per group and event)
+    def read(self, name: str, event: str) -> int | float:
+        total = 0
+        for path in glob.glob(f"{self._groupDir(name)}/mon_data/mon_L3_*/{event}"):
+            with open(path) as f:
+                value = f.read().strip()
+            if not value.isdigit():
+                if (name, event) not in self.unavailable:
+                    self.unavailable.add((name, event))
+                    print(f"(resctrl warning) {event} of {name} reads {value!r} in {os.path.dirname(path)}, "
+                          "recording NaN", file=sys.stderr)
+                return float('nan')
+            total += int(value)
+        return total
+
+    def sample(self):
+        values = {g: {e: self.read(g, e) for e in MON_EVENTS} for g in self.groups}
+        self.samples.append((time.monotonic(), values))
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    # take a first sample and keep sampling in the background until stop()
+    def start(self):
+        self.samples = []
+        self.unavailable = set()
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join()
+        self._thread = None
+        self.sample()
+
+    # time series of an event summed over the given groups
+    # as (seconds since start, value) pairs, cumulative events count bytes since start
+    def series(self, groups: List[str], event: str) -> List[Tuple[float, int]]:
+        if not self.samples: return []
+        t0, first = self.samples[0]
+        base = sum(first[g][event] for g in groups) if event in CUMULATIVE_EVENTS else 0
+        return [(t - t0, sum(values[g][event] for g in groups) - base) for t, values in self.samples]
+
+    # total of an event over the run: bytes moved for cumulative events, mean level otherwise
+    def total(self, groups: List[str], event: str) -> float:
+        points = self.series(groups, event)
+        if not points: return 0
+        if event in CUMULATIVE_EVENTS:
+            return points[-1][1]
+        return sum(v for _, v in points) / len(points)
+
+    # remove the monitoring groups from resctrl
+    def remove(self):
+        for name in self.groups:
+            try:
+                os.rmdir(self._groupDir(name))
+            except OSError:
+                pass
+        self.groups = dict()
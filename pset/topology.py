@@ -0,0 +1,159 @@
+# Author: Nicolas Winsten, nicolasd.winsten@gmail.com
+# Python: 3.10.6
+#
+# This module reads the cpu topology from sysfs and places the threads of
+# a ProgramSet's programs on cpus according to a placement policy
+#
+# policies:
+#   linear        - cpus in increasing id order (what ProgramSet did originally)
+#   compact       - fill a physical core's SMT siblings, then the next core of the same LLC
+#   spread        - round robin over the LLC domains, one thread per physical core before using siblings
+#   avoid-smt     - never place two threads on SMT siblings of the same physical core
+#   same-llc      - all programs share one LLC domain (contention on the LLC), one thread per physical core,
+#                   None if no domain has enough cores (use compact to share SMT siblings on purpose)
+#   different-llc - every program gets its own LLC domain (no LLC contention between programs)
+#   different-node - every program gets its own NUMA node (no LLC or memory controller shared,
+#                    with bindMemory), threads filling one LLC of the node before the next
+#
+
+import os
+import re
+import glob
+import json
+import hashlib
+import functools
+import subprocess
+import itertools as it
+from typing import List, Iterable
+from dataclasses import dataclass
+from hugepages import cpuNode
+
+POLICIES = ['linear', 'compact', 'spread', 'avoid-smt', 'same-llc', 'different-llc', 'different-node']
+
+@dataclass
+class Cpu:
+    id: int
+    socket: int
+    core: int       # physical core, unique over the whole machine
+    thread: int     # rank of this cpu among its core's SMT siblings (0 for the first)
+    llc: int        # id of the last level cache domain (lowest cpu sharing it)
+    node: int       # NUMA node
+
+# parse a sysfs cpu list such as "0-17,36-53"
+def parseCpuList(s: str) -> List[int]:
+    cpus = []
+    for part in s.strip().split(','):
+        if not part: continue
+        lo, _, hi = part.partition('-')
+        cpus.extend(range(int(lo), int(hi if hi else lo) + 1))
+    return cpus
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+# lowest cpu sharing the last level cache of the given cpu
+def _llc(cpu: int, sys: str) -> int:
+    caches = glob.glob(f"{sys}/devices/system/cpu/cpu{cpu}/cache/index[0-9]*")
+    if not caches: return 0
+    last = max(caches, key=lambda d: int(_read(f"{d}/level")))
+    return min(parseCpuList(_read(f"{last}/shared_cpu_list")))
+
+# read the topology of the online cpus
+def readTopology(sys: str = "/sys") -> List[Cpu]:
+    cpus = []
+    for d in glob.glob(f"{sys}/devices/system/cpu/cpu[0-9]*/topology"):
+        cpu = int(re.search(r"cpu(\d+)/topology$", d).group(1))
+        socket = int(_read(f"{d}/physical_package_id"))
+        siblings = parseCpuList(_read(f"{d}/thread_siblings_list"))
+        cpus.append(Cpu(cpu, socket, min(siblings), siblings.index(cpu), _llc(cpu, sys), cpuNode(cpu, sys)))
+    return sorted(cpus, key=lambda c: c.id)
+
+# order a set of cpus so that every physical core is used once before any sibling is used
+def _coresFirst(cpus: Iterable[Cpu]) -> List[Cpu]:
+    return sorted(cpus, key=lambda c: (c.thread, c.socket, c.llc, c.core))
+
+def _domains(cpus: Iterable[Cpu]) -> List[List[Cpu]]:
+    key = lambda c: c.llc
+    return [_coresFirst(d) for _, d in it.groupby(sorted(cpus, key=key), key=key)]
+
+# the first allowed cpu of each physical core, whichever of its SMT siblings that is
+def _onePerCore(cpus: Iterable[Cpu]) -> List[Cpu]:
+    first = dict()
+    for c in sorted(cpus, key=lambda c: c.thread):
+        first.setdefault(c.core, c)
+    return list(first.values())
+
+# split a list of cpus into consecutive chunks of the given sizes
+def _take(order: List[Cpu], sizes: List[int]) -> List[List[Cpu]] | None:
+    if sum(sizes) > len(order): return None
+    chunks, i = [], 0
+    for n in sizes:
+        chunks.append(order[i:i+n])
+        i += n
+    return chunks
+
+# give every program its own group of cpus, the biggest programs getting the biggest groups
+def _separate(groups: List[List[Cpu]], sizes: List[int]) -> List[List[Cpu]] | None:
+    groups = sorted(groups, key=len, reverse=True)
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    if len(sizes) > len(groups): return None
+    chunks = [None]*len(sizes)
+    for i, group in zip(order, groups):
+        if sizes[i] > len(group): return None
+        chunks[i] = group[:sizes[i]]
+    return chunks
+
+# choose cpus for programs of the given sizes (number of threads)
+# returns a list of cpus per program, or None if the cpus cannot satisfy the policy
+def allocate(cpus: List[Cpu], sizes: List[int], policy: str) -> List[List[Cpu]] | None:
+    match policy:
+        case 'linear':
+            return _take(sorted(cpus, key=lambda c: c.id), sizes)
+        case 'compact':
+            return _take(sorted(cpus, key=lambda c: (c.socket, c.llc, c.core, c.thread)), sizes)
+        case 'spread':
+            # interleave the domains: first core of each domain, then the second core of each, ...
+            rounds = it.zip_longest(*_domains(cpus))
+            return _take([c for r in rounds for c in r if c is not None], sizes)
+        case 'avoid-smt':
+            return _take(_coresFirst(_onePerCore(cpus)), sizes)
+        case 'same-llc':
+            # only one thread per physical core, so that programs contend on the LLC and not on cores
+            for domain in _domains(_onePerCore(cpus)):
+                chunks = _take(domain, sizes)
+                if chunks: return chunks
+            return None
+        case 'different-llc':
+            return _separate(_domains(cpus), sizes)
+        case 'different-node':
+            key = lambda c: c.node
+            return _separate([[c for d in _domains(n) for c in d] for _, n in it.groupby(sorted(cpus, key=key), key=key)],
+                             sizes)
+    raise ValueError(f"unknown placement policy {policy}")
+
+
+# hash describing the hardware of this machine (cpu model, topology, caches, memory, kernel),
+# runs from machines with different fingerprints should not be mixed in one dataset
+@functools.cache
+def fingerprint(sys: str = "/sys", proc: str = "/proc") -> str:
+    with open(f"{proc}/cpuinfo") as f:
+        models = sorted(set(re.findall(r"model name\s*:\s*(.*)", f.read())))
+    with open(f"{proc}/meminfo") as f:
+        memory = int(re.search(r"MemTotal:\s+(\d+)", f.read()).group(1)) // 2**20    # GiB, rounded down
+    getconf = subprocess.run(['getconf', '-a'], capture_output=True, text=True).stdout
+    caches = sorted(line.split()[0] + "=" + line.split()[1] for line in getconf.splitlines()
+                    if "CACHE" in line and len(line.split()) == 2)
+    cpus = readTopology(sys)
+    description = {
+        'models': models,
+        'cpus': len(cpus),
+        'sockets': len({c.socket for c in cpus}),
+        'cores': len({c.core for c in cpus}),
+        'llcs': len({c.llc for c in cpus}),
+        'nodes': len({c.node for c in cpus}),
+        'caches': caches,
+        'memory': memory,
+        'kernel': os.uname().release,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
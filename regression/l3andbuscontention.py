@@ -15,6 +15,7 @@
 import sys
 sys.path.append("../pset")
 from pset import Program, ProgramSet
+from contention import ContentionExperiment
 import numpy
 import pandas as pd
 import random
@@ -36,7 +37,7 @@ def program(delay):
     reps = 999999999                # reps is set very high to ensure timeout will cut the program off at 20s to make consistent measurements
     command = f"./rpd -with-outer-loop {arraySize} {stride} {reps} {delay}"
     # create 7 "threads" (instances) of the command
-    return Program([command]*7, label = f"delay{delay}")
+    return Program([command]*7, label = f"delay{delay}", memory = 8*arraySize)
 
 subprocess.run(["cp", "../syntheticbenchmarks/rpd.c", "."])
 subprocess.run(["gcc", "-O2", "rpd.c", "-o", "rpd"])
@@ -46,6 +47,9 @@ ps = ProgramSet(timeout='20s', cpus = range(18,36))
 # attempt to divide cache evenly between threads in programset
 # ps.setAutoCAT(True)
 
+# check the hugepage pools before each run and record the backing each program got
+ps.setHugepages(True)
+
 # provide perf event names to capture
 
 # we want to capture the sum of the RAM data reads for all a program's threads
@@ -72,47 +76,19 @@ scriptName, _ = os.path.splitext(os.path.basename(__file__))
 ps.dir = scriptName + "-data"
 
 
+# the experiment runs the programs separately first, then at the same time,
+# and measures slowdown based on the number of array accesses made
+experiment = ContentionExperiment(ps, progress="progress")
+
 for _ in range(100):
     [delayX, delayY] = random.choices(possible_delays, k=2)
     [progX, progY] = [program(delayX), program(delayY)]
 
-    # execute programs separately first
-    print("running", progX)
-    ps.setPrograms([progX])
-    [baseX] = ps.run(f"X")
-
-    print("running", progY)
-    ps.setPrograms([progY])
-    [baseY] = ps.run(f"Y")
-
-    # then execute them at the same time
-    print("running contended")
-    ps.setPrograms([progX,progY])
-    [contendedX, contendedY] = ps.run(f"XY")
-
-    # measure slowdown based on the number of array accesses made
-    slowdownX = baseX['progress'] / contendedX['progress']
-    slowdownY = baseY['progress'] / contendedY['progress']
-
-    # create dataframe row for this sample run
-    row = dict()
-    row['delayX'] = delayX
-    for k,v in baseX.items(): # gather features from program X's baseline run
-        row[k+'X'] = v
-
-    row['delayY'] = delayY
-    for k,v in baseY.items(): # gather features from program Y's baseline run
-        row[k+'Y'] = v
-
-    # gather features from the contended runs
-    for k,v in contendedX.items():
-        row[k+"X'"] = v
-    for k,v in contendedY.items():
-        row[k+"Y'"] = v
-
-    row['slowdownX'] = slowdownX
-    row['slowdownY'] = slowdownY
+    record = experiment.run([progX, progY], params=[{'delay': delayX}, {'delay': delayY}])
 
+    # create dataframe row for this sample run:
+    # the features of program X's baseline run are suffixed with X, those of the contended run with X'
+    row = record.row()
 
     # add record to the dataframe
     data = pd.concat([data, pd.DataFrame([row])], axis=0, ignore_index=True)
@@ -6,6 +6,7 @@
 import sys
 sys.path.append("../pset")
 from pset import Program, ProgramSet
+from contention import ContentionExperiment
 import numpy
 import random
 import pandas as pd
@@ -25,6 +26,10 @@ subprocess.run(["gcc", "-O2", "rpd.c", "-o", "rpd"])
 
 ps = ProgramSet(timeout='20s', cpus = range(18,36))
 
+# choose where X and Y run from the real topology instead of the order of the cpu list,
+# e.g. keep them on one LLC (and off each other's SMT siblings) to make them contend on L3
+# ps.setPlacement("same-llc", bindMemory=True)
+
 # provide perf events to capture
 ps.addEvent("offcore_response.all_data_rd.llc_miss.local_dram", sum)
 ps.addEvent("cycles", min)
@@ -43,47 +48,20 @@ ps.dir = scriptName + "-data"
 data = pd.DataFrame()
 delays = [0,1,2,3,4,5,6,7,8,9,12,15,18,24,32,64]
 
+# each sample runs X and Y alone, then together, and measures their slowdown from the array accesses made
+experiment = ContentionExperiment(ps, progress="progress")
+
 for _ in range(100):
     [delayX, delayY] = random.choices(delays, k=2)
 
     progX = program(delayX)
     progY = program(delayY)
 
-    # collect baseline features for each program
-    print("running", progX)
-    ps.setPrograms([progX])
-    # X is the descriptive string for this run
-    baseX = ps.run(f"X")[0]
-
-    print("running", progY)
-    ps.setPrograms([progY])
-    baseY = ps.run(f"Y")[0]
-
-    # run them together for contended features
-    print("running contended")
-    ps.setPrograms([progX,progY])
-    [contendedX, contendedY] = ps.run(f"XY")
-
-    slowdownX = baseX['progress'] / contendedX['progress']
-    slowdownY = baseY['progress'] / contendedY['progress']
-
-    row = {}
-    row['delayX'] = delayX
-    for k,v in baseX.items():
-        row[k+'X'] = v
-
-    row['delayY'] = delayY
-    for k,v in baseY.items():
-        row[k+'Y'] = v
-    for k,v in contendedX.items():
-        row[k+"X'"] = v
-    for k,v in contendedY.items():
-        row[k+"Y'"] = v
-    row['slowdownX'] = slowdownX
-    row['slowdownY'] = slowdownY
-
-
-    data = pd.concat([data, pd.DataFrame([row])], axis=0, ignore_index=True)
+    # X is the descriptive string for the runs of X alone, Y for Y alone and XY for the contended run
+    record = experiment.run([progX, progY], params=[{'delay': delayX}, {'delay': delayY}])
+
+    # one row: delayX, baseline features of X (e.g. progressX), delayY, ..., contended features (progressX'), slowdownX, slowdownY
+    data = pd.concat([data, pd.DataFrame([record.row()])], axis=0, ignore_index=True)
 
 data.to_csv(scriptName + ".csv", index=False)
 print(data)
@@ -6,6 +6,7 @@
 import sys
 sys.path.append("../pset")
 from pset import Program, ProgramSet
+from contention import ContentionExperiment
 import numpy
 import random
 import pandas as pd
@@ -18,13 +19,19 @@ def program(instances, delay):
     stride = 15                                             # large enough stride to ensure cache misses on each array access
     reps = 9999999                          # exorbitant number of repetitions to ensure the timeout normalizes all runtimes
     command = f"./rpd -with-outer-loop {arraySize} {stride} {reps} {delay}"
-    return Program([command]*instances, label = f"d{delay}i{instances}")
+    return Program([command]*instances, label = f"d{delay}i{instances}", memory = 8*arraySize)
 
 subprocess.run(["cp", "../syntheticbenchmarks/rpd.c", "."])
 subprocess.run(["gcc", "-O2", "rpd.c", "-o", "rpd"])
 
 ps = ProgramSet(timeout='20s', cpus = range(18,36))
 
+# cap the memory bandwidth of a program with MBA, e.g. ps.setMBA({progY.label: 30}),
+# or measure how much of the slowdown is recovered over throttle levels with ps.sweepMBA(...)
+
+# check the hugepage pools before each run and record the backing each program got
+ps.setHugepages(True)
+
 # provide perf events to capture
 ps.addEvent("offcore_response.all_data_rd.llc_miss.local_dram", sum)
 ps.addEvent("cycles", min)
@@ -42,6 +49,9 @@ data = pd.DataFrame()
 delays = [0,1,2,3,4,5,6,7,8,9,12,15,18,24,32,64]
 instances = [1,2,3,4,5,6,7,8,9]
 
+# each sample runs X and Y alone, then together, and measures their slowdown from the array accesses made
+experiment = ContentionExperiment(ps, progress="progress")
+
 for _ in range(100):
     [delayX, delayY] = random.choices(delays, k=2)
     [instancesX, instancesY] = random.choices(instances, k=2)
@@ -52,42 +62,10 @@ for _ in range(100):
     progX = program(instancesX, delayX)
     progY = program(instancesY, delayY)
 
-    # collect baseline features for each program
-    print("running", progX)
-    ps.setPrograms([progX])
-    baseX = ps.run(f"X")[0]
-
-    print("running", progY)
-    ps.setPrograms([progY])
-    baseY = ps.run(f"Y")[0]
-
-    # run them together for contended features
-    print("running contended")
-    ps.setPrograms([progX,progY])
-    [contendedX, contendedY] = ps.run(f"XY")
-
-    slowdownX = baseX['progress'] / contendedX['progress']
-    slowdownY = baseY['progress'] / contendedY['progress']
-
-    row = {}
-    row['delayX'] = delayX
-    row['instancesX'] = instancesX
-    for k,v in baseX.items():
-        row[k+'X'] = v
-
-    row['delayY'] = delayY
-    row['instancesY'] = instancesY
-    for k,v in baseY.items():
-        row[k+'Y'] = v
-    for k,v in contendedX.items():
-        row[k+"X'"] = v
-    for k,v in contendedY.items():
-        row[k+"Y'"] = v
-    row['slowdownX'] = slowdownX
-    row['slowdownY'] = slowdownY
-
-
-    data = pd.concat([data, pd.DataFrame([row])], axis=0, ignore_index=True)
+    record = experiment.run([progX, progY], params=[{'delay': delayX, 'instances': instancesX},
+                                                    {'delay': delayY, 'instances': instancesY}])
+
+    data = pd.concat([data, pd.DataFrame([record.row()])], axis=0, ignore_index=True)
 
 data.to_csv(scriptName + ".csv", index=False)
 print(data)
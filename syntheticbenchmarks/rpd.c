@@ -25,6 +25,7 @@ delay-size: number of junk computations to perform in between array accesses
 #include <sched.h>
 #include <sys/mman.h>
 #include <signal.h>
+#include <errno.h>
 
 // flag, set to true if array elements should be initialized
 int doInit = 1;
@@ -47,6 +48,52 @@ void report(int signum) {
 }
 
 
+// the kind of memory actually backing the array ("hugetlb", "thp" or "base"),
+// reported on stdout so the harness can record it alongside the sample
+const char *backing = "hugetlb";
+
+// map the array with explicit hugepages, falling back to transparent hugepages
+// when the hugetlb pool is exhausted (e.g. too many concurrent instances)
+void *allocate(size_t size) {
+  void *a = mmap(NULL, size, PROT_WRITE | PROT_READ,
+	MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+  if (a != MAP_FAILED) return a;
+
+  fprintf(stderr, "hugetlb mmap failed (%s), falling back to THP\n", strerror(errno));
+  a = mmap(NULL, size, PROT_WRITE | PROT_READ, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+  if (a == MAP_FAILED) {
+    perror("mmap");
+    exit(1);
+  }
+  backing = madvise(a, size, MADV_HUGEPAGE) == 0 ? "thp" : "base";
+  return a;
+}
+
+// madvise is only a hint, so look up how much of the mapping
+// the kernel really backed with transparent hugepages
+long long thpBytes(void *addr) {
+  FILE *smaps = fopen("/proc/self/smaps", "r");
+  if (!smaps) return 0;
+  char line[256];
+  unsigned long start, end;
+  long long kb = 0;
+  int inMapping = 0;
+  while (fgets(line, sizeof line, smaps)) {
+    if (sscanf(line, "%lx-%lx ", &start, &end) == 2)
+      inMapping = (unsigned long)addr >= start && (unsigned long)addr < end;
+    else if (inMapping && sscanf(line, "AnonHugePages: %lld kB", &kb) == 1)
+      break;
+  }
+  fclose(smaps);
+  return kb * 1024;
+}
+
+// settle and print the backing once the array has been touched
+void reportBacking(void *addr) {
+  if (strcmp(backing, "thp") == 0 && thpBytes(addr) == 0) backing = "base";
+  printf("memory backing: %s\n", backing); fflush(stdout);
+}
+
 // return number of flags given in argv
 int handleOpts(int argc, char **args) {
   if (argc == 0 || args[0][0] != '-') return 0;
@@ -89,9 +136,7 @@ int main(int argc, char **argv) {
 	//printf("%zuMB\n", arraySize*sizeof(long)/1000000);
 	printf("%fMB\n", workingSetSize/1000000.0);
 
-  /*volatile*/ long *a = (long *)
-	  mmap(NULL, sizeof(long) * arraySize, PROT_WRITE | PROT_READ,
-		MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+  /*volatile*/ long *a = (long *) allocate(sizeof(long) * arraySize);
  
 	long long i, j, k, l, outloop;
   
@@ -105,6 +150,8 @@ int main(int argc, char **argv) {
   for (i = arraySize-stride; i >= 0; i-=stride, progress++)
     a[i] = 1;
 
+	reportBacking(a);
+
 	printf("accessing..."); fflush(stdout);
   gettimeofday(&startTime, NULL);
   for (k = 0; k < reps; k++) {